@@ -2,4 +2,5 @@
 #exec_path="python `python -c "import site; print site.getsitepackages()[0]"`/wifi_control/__main__.py"
 #eval ${exec_path}
 mkdir -p /var/local/tmp
-python -m wifi_control.__main__ /var/local/tmp/wificonfig_data.p /var/local/tmp/wificonfig.log
+# set WIFICONFIG_TRACE_FILE to record a trace that can be replayed with wifi_control.wificonfigreplay
+python -m wifi_control.__main__ /var/local/tmp/wificonfig_data.p /var/local/tmp/wificonfig.log ${WIFICONFIG_TRACE_FILE}
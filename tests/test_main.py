@@ -0,0 +1,213 @@
+"""
+Tests for the connection sequence of the daemon, against a stand-in for wpa_supplicant and its timers.
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from wifi_control import main, wificonfiguration, wificonfigwatcher, wifiwpadbus
+
+__author__ = 'victor'
+
+
+INTERFACE_PATH = '/fi/w1/wpa_supplicant1/Interfaces/0'
+
+
+class FakeWpaSupplicant:
+    """
+    Answers the method calls made to wpa_supplicant, and keeps them.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.properties = {'Interfaces': [INTERFACE_PATH], 'State': 'scanning', 'Ifname': 'wlan0',
+                           'CurrentNetwork': '/'}
+        self.added_networks = 0
+
+    def call(self, object_path, interface_name, method_name, args):
+        self.calls.append((object_path, method_name, args))
+        if method_name == 'Get':
+            # a copy, as a new reply would be (the interfaces list is popped by the caller)
+            return copy.copy(self.properties[args[1]])
+        if method_name == 'AddNetwork':
+            self.added_networks += 1
+            return INTERFACE_PATH + '/Networks/%d' % self.added_networks
+        return None
+
+    def get_added_ssids(self):
+        return [str(args[0]['ssid']) for object_path, method_name, args in self.calls if method_name == 'AddNetwork']
+
+
+class FakeTimers:
+    """
+    Timers that are only run when the test says so.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.last_timer_id = 0
+
+    def add(self, seconds, callback, *args):
+        self.last_timer_id += 1
+        self.timers[self.last_timer_id] = (callback, args)
+        return self.last_timer_id
+
+    def remove(self, timer_id):
+        del self.timers[timer_id]
+
+    def run_all(self):
+        for timer_id in sorted(self.timers):
+            callback, args = self.timers.pop(timer_id)
+            if callback(*args):
+                self.timers[timer_id] = (callback, args)
+
+
+class FakeListener:
+
+    def __init__(self):
+        self.started = False
+        self.stopped = False
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeListenerConnectionSequence(main.ConnectionSequence):
+
+    def _get_ip_address(self, ifname):
+        return "127.0.0.1"
+
+    def _create_listener(self, ip):
+        return FakeListener()
+
+
+class ConnectionSequenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file_name = os.path.join(self.directory, "wificonfig.p")
+        wificonfiguration.check_wifi_configurations_file(self.data_file_name)
+        self.store = wificonfigwatcher.WifiConfigurationFileWatcher(self.data_file_name)
+        self.wpa_supplicant = FakeWpaSupplicant()
+        wifiwpadbus.set_wpa_method_caller(self.wpa_supplicant.call)
+        self.timers = FakeTimers()
+        self.sequence = FakeListenerConnectionSequence(self.store, self.timers)
+
+    def tearDown(self):
+        wifiwpadbus.set_wpa_method_caller(wifiwpadbus._call_wpa_method_on_system_bus)
+        self.store.stop()
+        shutil.rmtree(self.directory)
+
+    def complete_connection(self):
+        self.wpa_supplicant.properties['State'] = 'completed'
+        self.sequence.handle_signal(INTERFACE_PATH, wifiwpadbus.WPA_INTERFACE, 'PropertiesChanged',
+                                    ({'State': 'completed'},))
+
+    def change_running_configuration(self, ssid):
+        wifi_configuration = self.store.get_wifi_configuration()
+        wifi_configuration.set_current_config({wificonfiguration.SSID: ssid, wificonfiguration.PSK: u"Password"})
+        self.sequence.process_running_change(wifi_configuration, self.store)
+
+    def test_listens_after_connecting_to_bootstrap(self):
+        self.sequence.start()
+        self.complete_connection()
+        self.timers.run_all()
+        self.assertTrue(self.sequence.configurator_listener.started)
+        self.assertEqual(["Luminare360HotSpot"], self.wpa_supplicant.get_added_ssids())
+
+    def test_restart_while_listening_stops_the_listener(self):
+        self.sequence.start()
+        self.complete_connection()
+        self.timers.run_all()
+        listener = self.sequence.configurator_listener
+        self.change_running_configuration(u"Other")
+        self.assertTrue(listener.stopped)
+        self.assertIsNone(self.sequence.configurator_listener)
+        self.assertIsNone(self.sequence.bootstrap_source_id)
+        self.assertEqual(INTERFACE_PATH + '/Networks/2', self.sequence.running_network_path)
+
+    def test_restart_drops_the_pending_connection_attempt(self):
+        self.sequence.start()
+        self.change_running_configuration(u"Other")
+        self.complete_connection()
+        self.timers.run_all()
+        # the bootstrap connection callback was dropped, so the daemon is not listening
+        self.assertIsNone(self.sequence.configurator_listener)
+        self.assertIsNone(self.sequence.bootstrap_source_id)
+
+    def test_restart_goes_on_when_wpa_supplicant_is_unavailable(self):
+        def unavailable(object_path, interface_name, method_name, args):
+            raise EnvironmentError("wpa_supplicant is not running")
+        self.sequence.start()
+        wifiwpadbus.set_wpa_method_caller(unavailable)
+        self.change_running_configuration(u"Other")
+        self.assertIsNone(self.sequence.running_network_path)
+        self.timers.run_all()
+        self.assertIsNone(self.sequence.running_network_path)
+
+    def change_roaming(self):
+        wifi_configuration = self.store.get_wifi_configuration()
+        wifi_configuration.set_running_roaming_config({wificonfiguration.SIGNAL_THRESHOLD: -60})
+        self.sequence.process_roaming_change(wifi_configuration, self.store)
+
+    def get_calls(self, method_name):
+        return [(object_path, args) for object_path, called_method_name, args in self.wpa_supplicant.calls
+                if called_method_name == method_name]
+
+    def test_roaming_change_is_not_applied_to_bootstrap(self):
+        self.sequence.start()
+        self.complete_connection()
+        self.wpa_supplicant.properties['CurrentNetwork'] = INTERFACE_PATH + '/Networks/1'
+        self.change_roaming()
+        self.assertEqual([], self.get_calls('Set'))
+        self.assertEqual([], self.get_calls('Reassociate'))
+
+    def test_roaming_change_is_applied_to_the_running_network(self):
+        self.sequence.start()
+        self.change_running_configuration(u"Other")
+        self.complete_connection()
+        self.wpa_supplicant.properties['CurrentNetwork'] = self.sequence.running_network_path
+        self.change_roaming()
+        self.assertEqual([(self.sequence.running_network_path,
+                           (wifiwpadbus.WPA_NETWORK, 'Properties', {"bgscan": "simple:30:-60:300"}))],
+                         self.get_calls('Set'))
+        self.assertEqual(1, len(self.get_calls('Reassociate')))
+
+    def test_roaming_change_is_not_applied_to_another_network(self):
+        self.sequence.start()
+        self.change_running_configuration(u"Other")
+        self.wpa_supplicant.properties['CurrentNetwork'] = INTERFACE_PATH + '/Networks/1'
+        self.change_roaming()
+        self.assertEqual([], self.get_calls('Set'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Tests for the replay of traces: the stand-in bus, the replay clock timers, and the replay of a recorded session,
+as recorded and after diverging from it.
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+import dbus.exceptions
+
+from wifi_control import main, wificonfigreplay, wificonfiguration, wificonfigtrace, wificonfigwatcher, wifiwpadbus
+
+__author__ = 'victor'
+
+
+INTERFACE_PATH = '/fi/w1/wpa_supplicant1/Interfaces/0'
+GET_STATE = (INTERFACE_PATH, wifiwpadbus.PROPERTIES, 'Get', (wifiwpadbus.WPA_INTERFACE, 'State'))
+
+
+def build_call_records(timestamp, call, kind, values):
+    return [(wificonfigtrace.DBUS_CALL, timestamp, call),
+            (kind, timestamp + 1, call[:3] + values)]
+
+
+class ReplayBusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        records = build_call_records(100, GET_STATE, wificonfigtrace.DBUS_REPLY, (u"scanning",)) \
+            + build_call_records(200, GET_STATE, wificonfigtrace.DBUS_REPLY, (u"completed",)) \
+            + build_call_records(300, (INTERFACE_PATH, wifiwpadbus.WPA_INTERFACE, 'Scan', ()),
+                                 wificonfigtrace.DBUS_ERROR, ('fi.w1.wpa_supplicant1.NoReply', u"no reply"))
+        self.bus = wificonfigreplay.ReplayBus(records, lambda: self.now)
+
+    def test_answers_with_the_reply_recorded_up_to_the_clock(self):
+        self.assertEqual(u"scanning", self.bus.call(*GET_STATE))
+        self.now = 150
+        self.assertEqual(u"scanning", self.bus.call(*GET_STATE))
+        self.now = 250
+        self.assertEqual(u"completed", self.bus.call(*GET_STATE))
+        self.assertEqual(3, self.bus.answered)
+
+    def test_raises_the_recorded_errors(self):
+        try:
+            self.bus.call(INTERFACE_PATH, wifiwpadbus.WPA_INTERFACE, 'Scan', ())
+            self.fail("The recorded error was not raised")
+        except dbus.exceptions.DBusException as e:
+            self.assertEqual('fi.w1.wpa_supplicant1.NoReply', e.get_dbus_name())
+
+    def test_only_answers_calls_with_the_same_arguments(self):
+        try:
+            self.bus.call(INTERFACE_PATH, wifiwpadbus.PROPERTIES, 'Get', (wifiwpadbus.WPA_INTERFACE, 'Ifname'))
+            self.fail("A call that was not recorded was answered")
+        except dbus.exceptions.DBusException as e:
+            self.assertEqual(wificonfigreplay.REPLAY_NOT_RECORDED_ERROR, e.get_dbus_name())
+        self.assertRaises(dbus.exceptions.DBusException,
+                          self.bus.call, INTERFACE_PATH, wifiwpadbus.WPA_INTERFACE, 'Disconnect', ())
+        self.assertEqual(2, self.bus.unanswered)
+        self.assertEqual(0, self.bus.answered)
+
+
+class ReplayTimersTest(unittest.TestCase):
+
+    def test_runs_the_timers_in_order_on_the_replay_clock(self):
+        timers = wificonfigreplay.ReplayTimers(1000)
+        runs = []
+        timers.add(2, lambda: runs.append(("two", timers.now())))
+        first_id = timers.add(1, lambda: runs.append(("one", timers.now())) or len(runs) < 2)
+        removed_id = timers.add(1, lambda: runs.append(("removed", timers.now())))
+        timers.remove(removed_id)
+        while timers.get_next() is not None:
+            timers.run(timers.get_next()[1])
+        second = wificonfigtrace.NS_PER_SECOND
+        self.assertEqual([("one", 1000 + second), ("two", 1000 + 2 * second), ("one", 1000 + 2 * second)], runs)
+        self.assertNotIn(first_id, timers.timers)
+
+
+class ReplayerTest(unittest.TestCase):
+    """
+    A session is recorded with the daemon's connection sequence connecting to bootstrap against a stand-in for
+    wpa_supplicant, and then replayed.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file_name = os.path.join(self.directory, "wificonfig.p")
+        self.trace_file_name = os.path.join(self.directory, "trace")
+        self.configuration_store = None
+        self.session = self.record_session()
+
+    def tearDown(self):
+        wificonfigtrace.stop_tracing()
+        wifiwpadbus.set_wpa_method_caller(wifiwpadbus._call_wpa_method_on_system_bus)
+        del wifiwpadbus._wpa_signal_handlers[:]
+        if self.configuration_store is not None:
+            self.configuration_store.stop()
+        shutil.rmtree(self.directory)
+
+    def record_session(self):
+        def answer(object_path, interface_name, method_name, args):
+            if method_name == 'Get':
+                return {'Interfaces': [INTERFACE_PATH], 'State': 'completed'}[args[1]]
+            if method_name == 'AddNetwork':
+                return INTERFACE_PATH + '/Networks/0'
+            return None
+        wificonfiguration.check_wifi_configurations_file(self.data_file_name)
+        recorded_store = wificonfigwatcher.WifiConfigurationFileWatcher(self.data_file_name)
+        wifiwpadbus.set_wpa_method_caller(answer)
+        wificonfigtrace.start_tracing(self.trace_file_name, recorded_store.get_wifi_configuration().data)
+        wifiwpadbus.clean_configured_networks()
+        sequence = main.ConnectionSequence(recorded_store, wificonfigreplay.ReplayTimers(0))
+        wifiwpadbus.add_wpa_signal_handler(sequence.handle_signal)
+        sequence.start()
+        wifiwpadbus.dispatch_wpa_signal(INTERFACE_PATH, wifiwpadbus.WPA_INTERFACE, 'PropertiesChanged',
+                                        ({'State': 'completed'},))
+        wificonfigtrace.stop_tracing()
+        recorded_store.stop()
+        del wifiwpadbus._wpa_signal_handlers[:]
+        return wificonfigtrace.split_sessions(list(wificonfigtrace.read_trace(self.trace_file_name)))[-1]
+
+    def replay(self, configuration_data):
+        wificonfiguration.save_wifi_configuration_to(
+            self.data_file_name, wificonfiguration.WiFiConfiguration(configuration_data))
+        self.configuration_store = wificonfigwatcher.WifiConfigurationFileWatcher(self.data_file_name)
+        replayer = wificonfigreplay.Replayer(self.session, self.configuration_store, True)
+        replayer.run()
+        return replayer
+
+    def test_replays_the_recorded_session(self):
+        replayer = self.replay(wificonfigtrace.get_session_configuration_data(self.session))
+        self.assertEqual(0, replayer.bus.unanswered)
+        self.assertEqual(1, len(replayer.timings))
+        # the connection to bootstrap completed, so the daemon is waiting to listen for messages
+        self.assertIsNotNone(replayer.connection_sequence.bootstrap_source_id)
+
+    def test_a_diverged_replay_goes_on(self):
+        data = copy.deepcopy(wificonfigtrace.get_session_configuration_data(self.session))
+        data[wificonfiguration.BOOTSTRAP][wificonfiguration.SSID] = u"NotRecorded"
+        replayer = self.replay(data)
+        # adding the network that was not recorded fails as a connection error, and the sequence goes on
+        self.assertEqual(1, replayer.bus.unanswered)
+        self.assertEqual(1, len(replayer.timings))
+        self.assertIsNotNone(replayer.connection_sequence.bootstrap_source_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
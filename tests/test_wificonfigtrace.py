@@ -0,0 +1,168 @@
+"""
+Tests for the trace of the daemon: value encoding, and writing and reading trace files and their sessions.
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import pickle
+import shutil
+import stat
+import tempfile
+import unittest
+
+from wifi_control import wificonfiguration, wificonfigtrace
+
+__author__ = 'victor'
+
+
+class EncodeValueTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        value = (None, True, False, 0, -70, 2 ** 70, 1.5, b"\0bytes", u"\xf1and\xfa",
+                 [1, (2, 3)], {u"ssid": u"A", 2: [None]}, (), [], {})
+        self.assertEqual(value, wificonfigtrace.decode_value(wificonfigtrace.encode_value(value)))
+
+    def test_keeps_the_types(self):
+        value = wificonfigtrace.decode_value(wificonfigtrace.encode_value((b"s", u"u", [1], (1,), True)))
+        self.assertEqual([str, unicode, list, tuple, bool], [type(item) for item in value])
+
+    def test_round_trip_of_configuration_data(self):
+        data = wificonfiguration.build_dumb_wifi_configurations()
+        data[wificonfiguration.CURRENT][wificonfiguration.ROAMING] = dict(wificonfiguration.DEFAULT_ROAMING)
+        self.assertEqual(data, wificonfigtrace.decode_value(wificonfigtrace.encode_value(data)))
+
+    def test_rejects_values_that_are_not_plain(self):
+        self.assertRaises(TypeError, wificonfigtrace.encode_value, object())
+        self.assertRaises(TypeError, wificonfigtrace.encode_value, set([1]))
+
+    def test_rejects_malformed_data(self):
+        encoded = wificonfigtrace.encode_value((u"ssid", [1, 2]))
+        self.assertRaises(ValueError, wificonfigtrace.decode_value, encoded[:-1])
+        self.assertRaises(ValueError, wificonfigtrace.decode_value, encoded + b"N")
+        self.assertRaises(ValueError, wificonfigtrace.decode_value, b"")
+        self.assertRaises(ValueError, wificonfigtrace.decode_value, b"x")
+
+    def test_does_not_load_pickles(self):
+        self.assertRaises(ValueError, wificonfigtrace.decode_value, pickle.dumps((u"ssid", 1)))
+
+
+class TraceFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trace_file_name = os.path.join(self.directory, "trace")
+
+    def tearDown(self):
+        wificonfigtrace.stop_tracing()
+        shutil.rmtree(self.directory)
+
+    def write_session(self, configuration_data, datagram):
+        wificonfigtrace.start_tracing(self.trace_file_name, configuration_data)
+        wificonfigtrace.trace_smp_datagram(datagram)
+        wificonfigtrace.trace_dbus_call('/if/0', 'fi.w1.wpa_supplicant1.Interface', 'AddNetwork', ({u"ssid": b"A"},))
+        wificonfigtrace.trace_dbus_reply('/if/0', 'fi.w1.wpa_supplicant1.Interface', 'AddNetwork', '/if/0/Networks/0')
+        wificonfigtrace.trace_dbus_error('/if/0', 'fi.w1.wpa_supplicant1.Interface', 'Scan',
+                                         'fi.w1.wpa_supplicant1.NoReply', u"no reply")
+        wificonfigtrace.trace_dbus_signal('/if/0', 'fi.w1.wpa_supplicant1.Interface', 'PropertiesChanged',
+                                          ({u"State": u"completed"},))
+        wificonfigtrace.trace_service_call('set_roaming_thresholds', (10, -65, 100))
+        wificonfigtrace.trace_configuration_reload(configuration_data)
+        wificonfigtrace.stop_tracing()
+
+    def read_sessions(self):
+        return wificonfigtrace.split_sessions(list(wificonfigtrace.read_trace(self.trace_file_name)))
+
+    def test_round_trip(self):
+        data = wificonfiguration.build_dumb_wifi_configurations()
+        self.write_session(data, b"E\x09datagram")
+        records = list(wificonfigtrace.read_trace(self.trace_file_name))
+        self.assertEqual([wificonfigtrace.SESSION_START, wificonfigtrace.SMP_DATAGRAM, wificonfigtrace.DBUS_CALL,
+                          wificonfigtrace.DBUS_REPLY, wificonfigtrace.DBUS_ERROR, wificonfigtrace.DBUS_SIGNAL,
+                          wificonfigtrace.SERVICE_CALL, wificonfigtrace.CONFIGURATION_RELOAD],
+                         [record[0] for record in records])
+        self.assertEqual(sorted(record[1] for record in records), [record[1] for record in records])
+        self.assertEqual(os.getpid(), records[0][2][1])
+        self.assertEqual(b"E\x09datagram", records[1][2])
+        self.assertEqual(('/if/0', 'fi.w1.wpa_supplicant1.Interface', 'AddNetwork', ({u"ssid": b"A"},)),
+                         records[2][2])
+        self.assertEqual(('/if/0', 'fi.w1.wpa_supplicant1.Interface', 'Scan', 'fi.w1.wpa_supplicant1.NoReply',
+                          u"no reply"), records[4][2])
+        self.assertEqual(('set_roaming_thresholds', (10, -65, 100)), records[6][2])
+        self.assertEqual((data,), records[7][2])
+
+    def test_sessions(self):
+        first_data = wificonfiguration.build_dumb_wifi_configurations()
+        second_data = wificonfiguration.build_dumb_wifi_configurations()
+        second_data[wificonfiguration.RUNNING] = wificonfiguration.DEFAULT
+        self.write_session(first_data, b"first")
+        self.write_session(second_data, b"second")
+        sessions = self.read_sessions()
+        self.assertEqual(2, len(sessions))
+        self.assertEqual([8, 8], [len(session) for session in sessions])
+        self.assertEqual(first_data, wificonfigtrace.get_session_configuration_data(sessions[0]))
+        self.assertEqual(second_data, wificonfigtrace.get_session_configuration_data(sessions[1]))
+        self.assertEqual(b"second", sessions[1][1][2])
+
+    def test_records_without_session_start_are_a_first_session(self):
+        records = [(wificonfigtrace.SMP_DATAGRAM, 1, b"old"), (wificonfigtrace.SESSION_START, 2, (0.0, 1, None))]
+        sessions = wificonfigtrace.split_sessions(records)
+        self.assertEqual([[records[0]], [records[1]]], sessions)
+        self.assertIsNone(wificonfigtrace.get_session_configuration_data(sessions[0]))
+        self.assertEqual([], wificonfigtrace.split_sessions([]))
+
+    def test_is_only_readable_by_its_owner(self):
+        open(self.trace_file_name, "wb").close()
+        os.chmod(self.trace_file_name, 0o644)
+        self.write_session(wificonfiguration.build_dumb_wifi_configurations(), b"datagram")
+        self.assertEqual(wificonfigtrace.TRACE_FILE_MODE, stat.S_IMODE(os.stat(self.trace_file_name).st_mode))
+
+    def test_replaces_a_file_with_another_format(self):
+        f = open(self.trace_file_name, "wb")
+        f.write(b"WCTRACE1 and older records")
+        f.close()
+        self.write_session(wificonfiguration.build_dumb_wifi_configurations(), b"datagram")
+        self.assertEqual(1, len(self.read_sessions()))
+
+    def test_ignores_a_truncated_last_record(self):
+        self.write_session(wificonfiguration.build_dumb_wifi_configurations(), b"datagram")
+        size = os.path.getsize(self.trace_file_name)
+        f = open(self.trace_file_name, "r+b")
+        f.truncate(size - 1)
+        f.close()
+        self.assertEqual(7, len(list(wificonfigtrace.read_trace(self.trace_file_name))))
+
+    def test_does_not_write_until_started(self):
+        wificonfigtrace.trace_smp_datagram(b"datagram")
+        self.assertFalse(wificonfigtrace.is_tracing())
+        self.assertFalse(os.path.exists(self.trace_file_name))
+
+    def test_rejects_files_that_are_not_traces(self):
+        f = open(self.trace_file_name, "wb")
+        f.write(b"not a trace")
+        f.close()
+        self.assertRaises(ValueError, list, wificonfigtrace.read_trace(self.trace_file_name))
+
+
+if __name__ == '__main__':
+    unittest.main()
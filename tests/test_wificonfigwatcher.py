@@ -0,0 +1,163 @@
+"""
+Tests for the configuration data file watcher: inotify event parsing, change detection, and the writes made by the
+daemon itself.
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from wifi_control import wificonfiguration, wificonfigwatcher
+
+__author__ = 'victor'
+
+
+def build_inotify_event(mask, name):
+    padded_name = name + b"\0" * (16 - len(name) % 16)
+    return wificonfigwatcher.INOTIFY_EVENT_HEADER.pack(1, mask, 0, len(padded_name)) + padded_name
+
+
+class ParseInotifyEventsTest(unittest.TestCase):
+
+    def test_parses_every_event_in_the_chunk(self):
+        buf = build_inotify_event(wificonfigwatcher.IN_CLOSE_WRITE, b"wificonfig.p.tmp") \
+            + build_inotify_event(wificonfigwatcher.IN_MOVED_TO, b"wificonfig.p")
+        self.assertEqual([(wificonfigwatcher.IN_CLOSE_WRITE, b"wificonfig.p.tmp"),
+                          (wificonfigwatcher.IN_MOVED_TO, b"wificonfig.p")],
+                         wificonfigwatcher.parse_inotify_events(buf))
+
+    def test_parses_events_without_name(self):
+        buf = wificonfigwatcher.INOTIFY_EVENT_HEADER.pack(1, wificonfigwatcher.IN_Q_OVERFLOW, 0, 0)
+        self.assertEqual([(wificonfigwatcher.IN_Q_OVERFLOW, b"")], wificonfigwatcher.parse_inotify_events(buf))
+
+    def test_ignores_a_partial_header(self):
+        buf = build_inotify_event(wificonfigwatcher.IN_MOVED_TO, b"wificonfig.p") + b"\0" * 4
+        self.assertEqual([(wificonfigwatcher.IN_MOVED_TO, b"wificonfig.p")],
+                         wificonfigwatcher.parse_inotify_events(buf))
+
+
+class WifiConfigurationFileWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file_name = os.path.join(self.directory, "wificonfig.p")
+        wificonfiguration.check_wifi_configurations_file(self.data_file_name)
+        self.watcher = wificonfigwatcher.WifiConfigurationFileWatcher(self.data_file_name)
+        self.running_changes = []
+        self.roaming_changes = []
+        self.watcher.callback_to_process_running_change = \
+            lambda wifi_configuration, store: self.running_changes.append(wifi_configuration.data)
+        self.watcher.callback_to_process_roaming_change = \
+            lambda wifi_configuration, store: self.roaming_changes.append(wifi_configuration.data)
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.directory)
+
+    def write_externally(self, data):
+        # as an external tool would, rewriting the file in place
+        f = open(self.data_file_name, "wb")
+        f.write(pickle.dumps(data))
+        f.close()
+        self.watcher.handle_events()
+
+    def build_data(self, ssid, roaming=None):
+        data = wificonfiguration.build_dumb_wifi_configurations()
+        data[wificonfiguration.CURRENT] = {wificonfiguration.SSID: ssid, wificonfiguration.PSK: u"Password" + ssid}
+        if roaming is not None:
+            data[wificonfiguration.CURRENT][wificonfiguration.ROAMING] = roaming
+        return data
+
+    def get_running_ssid(self):
+        return self.watcher.get_wifi_configuration().get_running_config()[wificonfiguration.SSID]
+
+    def test_loads_the_file_when_created(self):
+        self.assertEqual(wificonfiguration.build_dumb_wifi_configurations(),
+                         self.watcher.get_wifi_configuration().data)
+
+    def test_reloads_a_running_configuration_change(self):
+        self.write_externally(self.build_data(u"Other"))
+        self.assertEqual(u"Other", self.get_running_ssid())
+        self.assertEqual([self.build_data(u"Other")], self.running_changes)
+        self.assertEqual([], self.roaming_changes)
+
+    def test_reloads_a_roaming_change(self):
+        current_ssid = self.get_running_ssid()
+        self.write_externally(self.build_data(current_ssid))
+        self.write_externally(self.build_data(current_ssid, {wificonfiguration.SIGNAL_THRESHOLD: -60}))
+        self.assertEqual(1, len(self.running_changes))
+        self.assertEqual([self.build_data(current_ssid, {wificonfiguration.SIGNAL_THRESHOLD: -60})],
+                         self.roaming_changes)
+
+    def test_ignores_other_files_and_unchanged_data(self):
+        f = open(os.path.join(self.directory, "other"), "wb")
+        f.write(b"other")
+        f.close()
+        self.watcher.handle_events()
+        self.write_externally(wificonfiguration.build_dumb_wifi_configurations())
+        self.assertEqual([], self.running_changes)
+
+    def test_ignores_its_own_writes(self):
+        wifi_configuration = self.watcher.get_wifi_configuration()
+        wifi_configuration.set_current_config({wificonfiguration.SSID: u"Saved", wificonfiguration.PSK: u"Password"})
+        self.watcher.save_wifi_configuration(wifi_configuration)
+        self.watcher.handle_events()
+        self.assertEqual(u"Saved", self.get_running_ssid())
+        self.assertEqual([], self.running_changes)
+
+    def test_reloads_a_change_back_to_data_saved_before(self):
+        # A saved by the daemon, B written by an external tool, then A written back
+        wifi_configuration = self.watcher.get_wifi_configuration()
+        wifi_configuration.set_current_config({wificonfiguration.SSID: u"A", wificonfiguration.PSK: u"PasswordA"})
+        self.watcher.save_wifi_configuration(wifi_configuration)
+        self.watcher.handle_events()
+        self.write_externally(self.build_data(u"B"))
+        self.write_externally(self.build_data(u"A"))
+        self.assertEqual([u"B", u"A"], [data[wificonfiguration.CURRENT][wificonfiguration.SSID]
+                                        for data in self.running_changes])
+        self.assertEqual(u"A", self.get_running_ssid())
+
+    def test_ignores_invalid_data(self):
+        data = self.build_data(u"Other")
+        del data[wificonfiguration.BOOTSTRAP]
+        self.write_externally(data)
+        self.write_externally(self.build_data(u"Other", {wificonfiguration.SIGNAL_THRESHOLD: 20}))
+        f = open(self.data_file_name, "wb")
+        f.write(b"not pickled data")
+        f.close()
+        self.watcher.handle_events()
+        self.assertEqual(wificonfiguration.build_dumb_wifi_configurations(),
+                         self.watcher.get_wifi_configuration().data)
+        self.assertEqual([], self.running_changes)
+
+    def test_returns_copies_of_the_configuration(self):
+        self.watcher.get_wifi_configuration().get_running_config()[wificonfiguration.SSID] = u"Changed"
+        self.assertNotEqual(u"Changed", self.get_running_ssid())
+
+
+if __name__ == '__main__':
+    unittest.main()
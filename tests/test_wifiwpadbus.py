@@ -0,0 +1,206 @@
+"""
+Tests for the roaming support: the roam monitor, the roaming thresholds data, and their management requests.
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import copy
+import unittest
+
+from wifi_control import wificonfiguration, wifiwpadbus
+
+__author__ = 'victor'
+
+
+INTERFACE_PATH = '/fi/w1/wpa_supplicant1/Interfaces/0'
+NETWORK = INTERFACE_PATH + '/Networks/0'
+OTHER_NETWORK = INTERFACE_PATH + '/Networks/1'
+BSS_A = INTERFACE_PATH + '/BSSs/0'
+BSS_B = INTERFACE_PATH + '/BSSs/1'
+NS_PER_MS = 1000000
+
+
+class RoamMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.monitor = wifiwpadbus.RoamMonitor(lambda: self.now)
+
+    def change_interface(self, ms, **changed):
+        self.now = ms * NS_PER_MS
+        self.monitor.handle_signal(INTERFACE_PATH, wifiwpadbus.WPA_INTERFACE, 'PropertiesChanged', (changed,))
+
+    def change_signal(self, bss, level):
+        # as the org.freedesktop.DBus.Properties signal
+        self.monitor.handle_signal(bss, wifiwpadbus.PROPERTIES, 'PropertiesChanged',
+                                   (wifiwpadbus.WPA_BSS, {'Signal': level}, []))
+
+    def connect(self, ms, network=NETWORK, bss=BSS_A):
+        self.change_interface(ms, State='completed', CurrentNetwork=network, CurrentBSS=bss)
+
+    def test_records_a_roam(self):
+        self.connect(0)
+        self.change_signal(BSS_A, -78)
+        self.change_interface(1000, State='authenticating', CurrentBSS=BSS_B)
+        self.change_interface(1040, State='associated')
+        self.change_interface(1065, State='completed')
+        self.assertEqual([(BSS_A, BSS_B, 65.0, -78)], self.monitor.get_roam_events())
+
+    def test_records_a_roam_without_state_changes(self):
+        self.connect(0)
+        self.change_interface(500, CurrentBSS=BSS_B)
+        self.assertEqual([(BSS_A, BSS_B, 0.0, 0)], self.monitor.get_roam_events())
+
+    def test_ignores_the_signal_of_other_bss(self):
+        self.connect(0)
+        self.change_signal(BSS_B, -40)
+        self.change_interface(1000, State='authenticating', CurrentBSS=BSS_B)
+        self.change_interface(1010, State='completed')
+        self.assertEqual(0, self.monitor.get_roam_events()[0][3])
+
+    def test_a_disconnection_is_not_a_roam(self):
+        self.connect(0)
+        self.change_interface(1000, State='disconnected', CurrentBSS='/')
+        self.change_interface(3000, State='completed', CurrentBSS=BSS_B)
+        self.assertEqual([], self.monitor.get_roam_events())
+
+    def test_a_disconnected_state_in_the_middle_is_not_a_roam(self):
+        self.connect(0)
+        self.change_interface(1000, State='authenticating', CurrentBSS=BSS_B)
+        self.change_interface(1100, State='disconnected')
+        self.change_interface(1200, State='completed')
+        self.assertEqual([], self.monitor.get_roam_events())
+
+    def test_a_network_change_is_not_a_roam(self):
+        self.connect(0)
+        self.change_interface(1000, State='associating', CurrentNetwork=OTHER_NETWORK, CurrentBSS=BSS_B)
+        self.change_interface(1100, State='completed')
+        self.assertEqual([], self.monitor.get_roam_events())
+
+    def test_reassociating_to_the_same_bss_is_not_a_roam(self):
+        self.connect(0)
+        self.change_interface(1000, State='associating')
+        self.change_interface(1100, State='completed')
+        self.assertEqual([], self.monitor.get_roam_events())
+
+    def test_roams_after_a_reconnection(self):
+        self.connect(0)
+        self.change_interface(1000, State='disconnected', CurrentBSS='/')
+        self.change_interface(2000, State='completed', CurrentBSS=BSS_A)
+        self.change_interface(3000, State='authenticating', CurrentBSS=BSS_B)
+        self.change_interface(3020, State='completed')
+        self.assertEqual([(BSS_A, BSS_B, 20.0, 0)], self.monitor.get_roam_events())
+
+    def test_keeps_the_last_roam_events(self):
+        self.connect(0)
+        for i in range(wifiwpadbus.ROAM_EVENTS_KEPT + 1):
+            self.change_interface(i + 1, CurrentBSS=BSS_B if i % 2 == 0 else BSS_A)
+        events = self.monitor.get_roam_events()
+        self.assertEqual(wifiwpadbus.ROAM_EVENTS_KEPT, len(events))
+        self.assertEqual((BSS_B, BSS_A), events[0][:2])
+
+
+class RoamingConfigurationTest(unittest.TestCase):
+
+    def test_valid_roaming_thresholds(self):
+        self.assertTrue(wificonfiguration.is_valid_roaming_config({}))
+        self.assertTrue(wificonfiguration.is_valid_roaming_config({wificonfiguration.SIGNAL_THRESHOLD: -100}))
+        self.assertTrue(wificonfiguration.is_valid_roaming_config({wificonfiguration.SIGNAL_THRESHOLD: 0}))
+        self.assertTrue(wificonfiguration.is_valid_roaming_config(
+            {wificonfiguration.SHORT_INTERVAL: 10, wificonfiguration.SIGNAL_THRESHOLD: -65,
+             wificonfiguration.LONG_INTERVAL: 10}))
+
+    def test_invalid_roaming_thresholds(self):
+        for roaming in (None, [], {"unknown": 1},
+                        {wificonfiguration.SIGNAL_THRESHOLD: -101},
+                        {wificonfiguration.SIGNAL_THRESHOLD: 1},
+                        {wificonfiguration.SIGNAL_THRESHOLD: -70.5},
+                        {wificonfiguration.SIGNAL_THRESHOLD: "-70"},
+                        {wificonfiguration.SHORT_INTERVAL: True},
+                        {wificonfiguration.SHORT_INTERVAL: 0},
+                        {wificonfiguration.SHORT_INTERVAL: 400},
+                        {wificonfiguration.LONG_INTERVAL: 10}):
+            self.assertFalse(wificonfiguration.is_valid_roaming_config(roaming), roaming)
+
+    def test_default_roaming_thresholds(self):
+        self.assertEqual(wificonfiguration.DEFAULT_ROAMING, wificonfiguration.get_roaming_config({}))
+        roaming = wificonfiguration.get_roaming_config(
+            {wificonfiguration.ROAMING: {wificonfiguration.SHORT_INTERVAL: 5}})
+        self.assertEqual(5, roaming[wificonfiguration.SHORT_INTERVAL])
+        self.assertEqual(wificonfiguration.DEFAULT_ROAMING[wificonfiguration.LONG_INTERVAL],
+                         roaming[wificonfiguration.LONG_INTERVAL])
+
+    def test_build_bgscan(self):
+        self.assertEqual("simple:30:-70:300", wifiwpadbus.build_bgscan(30, -70, 300))
+
+
+class FakeConfigurationStore:
+
+    def __init__(self):
+        self.wifi_configuration = wificonfiguration.WiFiConfiguration(
+            wificonfiguration.build_dumb_wifi_configurations())
+        self.saved = 0
+
+    def get_wifi_configuration(self):
+        return wificonfiguration.WiFiConfiguration(copy.deepcopy(self.wifi_configuration.data))
+
+    def save_wifi_configuration(self, wifi_configuration):
+        self.wifi_configuration = wifi_configuration
+        self.saved += 1
+
+
+class WiFiConfigurationControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = FakeConfigurationStore()
+        self.applied = []
+        self.controller = wifiwpadbus.WiFiConfigurationController(
+            self.store, wifiwpadbus.RoamMonitor(),
+            lambda wifi_configuration, store: self.applied.append(wifi_configuration.get_running_config()))
+
+    def test_sets_the_roaming_thresholds_of_the_running_configuration(self):
+        self.assertTrue(self.controller.set_roaming_thresholds(10, -65, 100))
+        self.assertEqual((10, -65, 100), self.controller.get_roaming_thresholds())
+        self.assertEqual(1, self.store.saved)
+        self.assertEqual(1, len(self.applied))
+        self.assertEqual({wificonfiguration.SHORT_INTERVAL: 10, wificonfiguration.SIGNAL_THRESHOLD: -65,
+                          wificonfiguration.LONG_INTERVAL: 100},
+                         self.store.wifi_configuration.get_running_config()[wificonfiguration.ROAMING])
+
+    def test_does_nothing_if_unchanged(self):
+        default = wificonfiguration.DEFAULT_ROAMING
+        self.assertFalse(self.controller.set_roaming_thresholds(
+            default[wificonfiguration.SHORT_INTERVAL], default[wificonfiguration.SIGNAL_THRESHOLD],
+            default[wificonfiguration.LONG_INTERVAL]))
+        self.assertEqual(0, self.store.saved)
+        self.assertEqual([], self.applied)
+
+    def test_rejects_invalid_thresholds(self):
+        self.assertRaises(ValueError, self.controller.set_roaming_thresholds, 10, 20, 100)
+        self.assertRaises(ValueError, self.controller.set_roaming_thresholds, 100, -65, 10)
+        self.assertEqual(0, self.store.saved)
+        self.assertEqual([], self.applied)
+
+
+if __name__ == '__main__':
+    unittest.main()
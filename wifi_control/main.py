@@ -4,12 +4,17 @@
 
 """
 Launcher for the WiFiConfig component. Based on wpa_supplicant service, and DBUS.
-The main loop handles:
+Everything runs in a single GLib main loop, that dispatches the UDP socket, the DBUS method calls and signals, the
+configuration data file watch, and the timers. The main loop handles:
     * checking existing database (data stored in a single binary file) for network configurations data.
     * cleaning the network configurations previously handled by wpa_supplicant.
     * connects to a network whose configuration is provided by the network configurations data.
     * launches a DBUS service that offers simple access to the current running network configuration.
-    * launches a worker thread that listens via UDP for Luminare Configuration messages.
+    * records the roam events between BSSs, as driven by the wpa_supplicant background scans of each network.
+    * listens via UDP for Luminare Configuration messages, while connected to the bootstrap network configuration.
+    * optionally, traces the received messages and the wpa_supplicant interactions (see wificonfigtrace).
+    * watches the network configurations data file, reconnecting when external tools change the running network
+      configuration.
 """
 
 
@@ -37,62 +42,87 @@ The main loop handles:
 import socket
 import fcntl
 import struct
-import time
 import sys
-import wifiwpadbus, simplemessageprotocol, wificonfiguration, wificonfiglogger
+
+import dbus.exceptions
+import gobject
+
+import wifiwpadbus, simplemessageprotocol, wificonfiguration, wificonfiglogger, wificonfigwatcher, wificonfigtrace
 
 __author__ = 'victor'
 
 
-NUMBER_OF_BOOTSTRAP_CONNECTION_TRIES = 15
+NUMBER_OF_BOOTSTRAP_CONNECTION_TRIES = 15  # seconds waiting for a connection to complete
+BOOTSTRAP_SETTLE_TIME = 5                   # seconds between the bootstrap connection and listening for messages
+BOOTSTRAP_LISTENING_TIME = 10               # seconds listening for messages while connected to bootstrap
+
+# errors the connection sequence recovers from, i.e. wpa_supplicant restarting, or the interface without an address
+CONNECTION_ERRORS = (dbus.exceptions.DBusException, EnvironmentError)
 
 
-def process_configuration(wifi_configuration, data_file_name):
+def process_configuration(wifi_configuration, configuration_store):
     """
     Connects to the provided network configuration.
     And stores that network configuration in the network configuration data handled.
     :param wifi_configuration:
+    :param configuration_store: the WifiConfigurationFileWatcher that keeps the network configurations data.
     :return:
     """
     wificonfiglogger.get_logger().info("Processing network configuration: " + str(wifi_configuration))
-    wifi_configurations = wificonfiguration.load_wifi_configuration_from(data_file_name)
+    wifi_configurations = configuration_store.get_wifi_configuration()
     if wifi_configuration[wificonfiguration.SSID] != (wifi_configurations.get_running_config())[wificonfiguration.SSID]:
         wifi_configurations.set_current_config(wifi_configuration)
-        wificonfiguration.save_wifi_configuration_to(data_file_name, wifi_configurations)
+        configuration_store.save_wifi_configuration(wifi_configurations)
+
+
+def get_bgscan(network_configuration):
+    """
+    :param network_configuration: a network configuration.
+    :return: the wpa_supplicant bgscan value for its roaming thresholds.
+    """
+    roaming = wificonfiguration.get_roaming_config(network_configuration)
+    return wifiwpadbus.build_bgscan(
+        roaming[wificonfiguration.SHORT_INTERVAL],
+        roaming[wificonfiguration.SIGNAL_THRESHOLD],
+        roaming[wificonfiguration.LONG_INTERVAL])
 
 
-def connect_to_bootstrap(data_file_name):
+def connect_to_bootstrap(configuration_store):
     """
     Connects to the bootstrap network configuration.
-    Assumption: the network configurations data has already been persisted.
-    :return: nothing.
+    :param configuration_store: the WifiConfigurationFileWatcher that keeps the network configurations data.
+    :return: the object path of the network added to wpa_supplicant.
     """
-    wifi_configuration = wificonfiguration.load_wifi_configuration_from(data_file_name)
+    wifi_configuration = configuration_store.get_wifi_configuration()
     bootstrap_configuration = wifi_configuration.get_bootstrap_config()
     wificonfiglogger.get_logger().info("Trying to connect to: " + bootstrap_configuration[wificonfiguration.SSID])
     new_network_object_path = \
         wifiwpadbus.add_new_network(
             wifiwpadbus.create_new_network_properties_map(
                 bootstrap_configuration[wificonfiguration.SSID],
-                bootstrap_configuration[wificonfiguration.PSK]))
+                bootstrap_configuration[wificonfiguration.PSK],
+                get_bgscan(bootstrap_configuration)))
     wifiwpadbus.connect_to_network(new_network_object_path)
+    return new_network_object_path
 
 
-def connect_to_current(data_file_name):
+def connect_to_current(configuration_store):
     """
     Connects to the previously set current network configuration.
-    Assumption: the network configurations data has already been persisted.
-    :return: nothing.
+    :param configuration_store: the WifiConfigurationFileWatcher that keeps the network configurations data.
+    :return: the object path of the network added to wpa_supplicant.
     """
-    wifi_configuration = wificonfiguration.load_wifi_configuration_from(data_file_name)
+    wifi_configuration = configuration_store.get_wifi_configuration()
     running_configuration = wifi_configuration.get_running_config()
     wificonfiglogger.get_logger().info("Trying to connect to: " + running_configuration[wificonfiguration.SSID])
     new_network_object_path = \
         wifiwpadbus.add_new_network(
             wifiwpadbus.create_new_network_properties_map(
                 running_configuration[wificonfiguration.SSID],
-                running_configuration[wificonfiguration.PSK]))
+                running_configuration[wificonfiguration.PSK],
+                get_bgscan(running_configuration)))
     wifiwpadbus.connect_to_network(new_network_object_path)
+    return new_network_object_path
 
 
 def get_ip_address(ifname):
@@ -109,55 +139,238 @@ def get_ip_address(ifname):
     )[20:24])
 
 
-def wait_for_connection(number_of_tries):
-    connection_try_number = 0
-    while "completed" != wifiwpadbus.get_managed_network_property('State') and connection_try_number < number_of_tries:
-        connection_try_number += 1
-        time.sleep(1)
-    if connection_try_number < number_of_tries:
+class MainLoopTimers:
+    """
+    Timers of the GLib main loop, as used by a ConnectionSequence.
+    """
+
+    def add(self, seconds, callback, *args):
+        """
+        Calls callback(*args) after the given seconds, and again each time it returns True.
+        :return: an id for the timer.
+        """
+        return gobject.timeout_add_seconds(seconds, callback, *args)
+
+    def remove(self, timer_id):
+        gobject.source_remove(timer_id)
+
+
+class ConnectionSequence:
+    """
+    Drives the connection sequence from the GLib main loop, without blocking it:
+        * connects to the bootstrap network configuration.
+        * if connected, waits a bit and listens for Luminare Configuration messages for a while.
+        * connects to the current network configuration; if that fails, starts again from the bootstrap one.
+    Each connection attempt is completed when wpa_supplicant reaches the "completed" state, as notified by its signals
+    or checked once per second, and fails after NUMBER_OF_BOOTSTRAP_CONNECTION_TRIES checks.
+    Errors talking to wpa_supplicant or setting up the listener (see CONNECTION_ERRORS) are logged, and the sequence
+    goes on with the next step, so it never stops.
+    When the running network configuration changes in the network configurations data, the sequence is restarted from
+    the current network configuration (see process_running_change).
+    Its timers are those of the main loop, unless others are given (i.e. the replay clock, see wificonfigreplay).
+    """
+
+    def __init__(self, configuration_store, timers=None):
+        self.configuration_store = configuration_store
+        self.timers = timers if timers is not None else MainLoopTimers()
+        self.connection_callback = None
+        self.connection_wait_id = 0
+        self.connection_try_number = 0
+        self.configurator_listener = None
+        self.bootstrap_source_id = None
+        self.running_network_path = None
+
+    def start(self):
+        self._try_bootstrap()
+
+    def restart(self):
+        """
+        Drops the pending connection attempt, and the bootstrap listening if any, and connects to the current network
+        configuration.
+        """
+        self.connection_callback = None
+        self.connection_wait_id += 1
+        if self.bootstrap_source_id is not None:
+            self.timers.remove(self.bootstrap_source_id)
+            self.bootstrap_source_id = None
+        if self.configurator_listener is not None:
+            self.configurator_listener.stop()
+            self.configurator_listener = None
+        try:
+            wifiwpadbus.clean_configured_networks()
+        except CONNECTION_ERRORS as e:
+            wificonfiglogger.get_logger().warning("Cannot clean the configured networks: " + str(e))
+        self._try_current()
+
+    def process_running_change(self, wifi_configuration, configuration_store):
+        """
+        Connects again to the running network configuration, after its data changed in the network configurations
+        data (see wificonfigwatcher).
+        :param wifi_configuration: the reloaded network configurations data.
+        :return: nothing.
+        """
+        wificonfiglogger.get_logger().info(
+            "Running network configuration changed to: "
+            + wifi_configuration.get_running_config()[wificonfiguration.SSID])
+        self.restart()
+
+    def process_roaming_change(self, wifi_configuration, configuration_store):
+        """
+        Applies the roaming thresholds of the running network configuration to its network, reassociating to it, after
+        they changed in the network configurations data (see wificonfigwatcher, and the DBUS service).
+        They are only applied while connected to the running network configuration (i.e. not to the bootstrap one);
+        otherwise they are used on the next connection to it.
+        :param wifi_configuration: the network configurations data, with the new roaming thresholds.
+        :return: nothing.
+        """
+        running_configuration = wifi_configuration.get_running_config()
+        wificonfiglogger.get_logger().info("Roaming thresholds changed to: " + get_bgscan(running_configuration))
+        applied = False
+        if self.running_network_path is not None:
+            try:
+                applied = wifiwpadbus.set_network_bgscan(self.running_network_path, get_bgscan(running_configuration))
+            except CONNECTION_ERRORS as e:
+                wificonfiglogger.get_logger().warning("Cannot apply the roaming thresholds: " + str(e))
+        if not applied:
+            wificonfiglogger.get_logger().info(
+                "Not connected to the running network configuration, roaming thresholds will be used on the next "
+                "connection")
+
+    def handle_signal(self, object_path, interface_name, signal_name, args):
+        changed_properties = wifiwpadbus.get_changed_properties(interface_name, signal_name, args)
+        if changed_properties is None or changed_properties[0] != wifiwpadbus.WPA_INTERFACE:
+            return
+        if self.connection_callback is not None and changed_properties[1].get('State') == "completed":
+            self._end_wait_for_connection(True)
+
+    def _wait_for_connection(self, callback):
+        self.connection_callback = callback
+        self.connection_wait_id += 1
+        self.connection_try_number = 0
+        self.timers.add(1, self._check_connection, self.connection_wait_id)
+
+    def _check_connection(self, connection_wait_id):
+        if self.connection_callback is None or connection_wait_id != self.connection_wait_id:
+            # this wait already ended, by a signal
+            return False
+        try:
+            state = wifiwpadbus.get_managed_network_property('State')
+        except CONNECTION_ERRORS as e:
+            wificonfiglogger.get_logger().warning("Cannot check the connection state: " + str(e))
+            self._end_wait_for_connection(False)
+            return False
+        if "completed" == state:
+            self._end_wait_for_connection(True)
+            return False
+        self.connection_try_number += 1
+        if self.connection_try_number >= NUMBER_OF_BOOTSTRAP_CONNECTION_TRIES:
+            self._end_wait_for_connection(False)
+            return False
         return True
-    else:
+
+    def _end_wait_for_connection(self, connected):
+        callback = self.connection_callback
+        self.connection_callback = None
+        callback(connected)
+
+    def _try_connection(self, connect, callback):
+        """
+        :return: the object path of the network added to wpa_supplicant, or None if it could not be added.
+        """
+        network_path = None
+        try:
+            network_path = connect(self.configuration_store)
+        except CONNECTION_ERRORS as e:
+            wificonfiglogger.get_logger().warning("Cannot connect: " + str(e))
+        self._wait_for_connection(callback)
+        return network_path
+
+    def _try_bootstrap(self):
+        wificonfiglogger.get_logger().info("Trying bootstrap network configuration")
+        self.running_network_path = None
+        self._try_connection(connect_to_bootstrap, self._on_bootstrap_connection)
+
+    def _on_bootstrap_connection(self, connected):
+        if connected:
+            wificonfiglogger.get_logger().info("Connection to bootstrap completed")
+            self.bootstrap_source_id = self.timers.add(BOOTSTRAP_SETTLE_TIME, self._start_listening)
+        else:
+            wificonfiglogger.get_logger().info("Cannot connect to bootstrap, trying current network configuration")
+            self._try_current()
+
+    def _start_listening(self):
+        self.bootstrap_source_id = None
+        try:
+            ifname = wifiwpadbus.get_managed_network_property('Ifname').__str__()
+            wificonfiglogger.get_logger().info("WiFiConfigurationDBUSService initialized for: " + ifname)
+            ip = self._get_ip_address(ifname)
+            self.configurator_listener = self._create_listener(ip)
+            wificonfiglogger.get_logger().info("Launching listener for ip: " + ip)
+            self.configurator_listener.start()
+        except CONNECTION_ERRORS as e:
+            wificonfiglogger.get_logger().warning("Cannot listen for messages, trying current network configuration: "
+                                                  + str(e))
+            if self.configurator_listener is not None:
+                self.configurator_listener.stop()
+                self.configurator_listener = None
+            self._try_current()
+            return False
+        wificonfiglogger.get_logger().info("Waiting... ")
+        self.bootstrap_source_id = self.timers.add(BOOTSTRAP_LISTENING_TIME, self._stop_listening)
         return False
 
+    def _get_ip_address(self, ifname):
+        return get_ip_address(ifname)
+
+    def _create_listener(self, ip):
+        return simplemessageprotocol.WifiConfigurationMessageListener(
+            ip, process_configuration, self.configuration_store)
+
+    def _stop_listening(self):
+        self.bootstrap_source_id = None
+        self.configurator_listener.stop()
+        self.configurator_listener = None
+        wificonfiglogger.get_logger().info("Ending bootstrap, trying current network configuration")
+        self._try_current()
+        return False
+
+    def _try_current(self):
+        self.running_network_path = self._try_connection(connect_to_current, self._on_current_connection)
+
+    def _on_current_connection(self, connected):
+        if connected:
+            wificonfiglogger.get_logger().info("Connection to current completed")
+        else:
+            self._try_bootstrap()
+
 
 def main():
-    if len(sys.argv) != 3:
-        print 'This module needs 2 arguments: DATA_FILE_NAME, LOG_FILE_NAME'
+    if len(sys.argv) not in (3, 4):
+        print 'This module needs 2 arguments: DATA_FILE_NAME, LOG_FILE_NAME (and optionally TRACE_FILE_NAME)'
     data_file_name = sys.argv[1]
     log_file_name = sys.argv[2]
     logger = wificonfiglogger.initialize_logger(log_file_name)
+    main_loop = gobject.MainLoop()
+    wifiwpadbus.listen_to_wpa_signals()
     wificonfiguration.check_wifi_configurations_file(data_file_name)
     logger.info("Configurations checked")
+    configuration_watcher = wificonfigwatcher.WifiConfigurationFileWatcher(data_file_name)
+    if len(sys.argv) == 4:
+        wificonfigtrace.start_tracing(sys.argv[3], configuration_watcher.get_wifi_configuration().data)
+        logger.info("Tracing to: " + sys.argv[3])
     wifiwpadbus.clean_configured_networks()
 
-    connected_to_current = False
-    service = wifiwpadbus.WiFiConfigurationDBUSService()
-
-    while not connected_to_current:
-        logger.info("Trying bootstrap network configuration")
-        connect_to_bootstrap(data_file_name)
-        connected_to_bootstrap = wait_for_connection(NUMBER_OF_BOOTSTRAP_CONNECTION_TRIES)
-        if connected_to_bootstrap:
-            logger.info("Connection to bootstrap completed")
-            time.sleep(5)
-            logger.info(
-                "WiFiConfigurationDBUSService initialized for: "
-                + wifiwpadbus.get_managed_network_property('Ifname').__str__())
-            ip = get_ip_address(wifiwpadbus.get_managed_network_property('Ifname').__str__())
-            configurator_listener = \
-                simplemessageprotocol.WifiConfigurationMessageListener(ip, process_configuration, data_file_name)
-            logger.info("Launching listener for ip: " + ip)
-            configurator_listener.start()
-            logger.info("Waiting... ")
-            time.sleep(10)
-            configurator_listener.stop()
-            logger.info("Ending bootstrap, trying current network configuration")
-            connect_to_current(data_file_name)
-            connected_to_current = wait_for_connection(NUMBER_OF_BOOTSTRAP_CONNECTION_TRIES)
-        else:
-            logger.info("Cannot connect to bootstrap, trying current network configuration")
-            connect_to_current(data_file_name)
-            connected_to_current = wait_for_connection(NUMBER_OF_BOOTSTRAP_CONNECTION_TRIES)
+    roam_monitor = wifiwpadbus.RoamMonitor()
+    wifiwpadbus.add_wpa_signal_handler(roam_monitor.handle_signal)
+    connection_sequence = ConnectionSequence(configuration_watcher)
+    wifiwpadbus.add_wpa_signal_handler(connection_sequence.handle_signal)
+
+    controller = wifiwpadbus.WiFiConfigurationController(
+        configuration_watcher, roam_monitor, connection_sequence.process_roaming_change)
+    service = wifiwpadbus.WiFiConfigurationDBUSService(controller)
+
+    configuration_watcher.start(connection_sequence.process_running_change, connection_sequence.process_roaming_change)
+    connection_sequence.start()
 
-    if connected_to_current:
-        logger.info("Connection to current completed")
+    logger.info("Running main loop")
+    main_loop.run()
@@ -1,6 +1,6 @@
 """
 This module handles how to receive Luminare Simple Message Protocol messages.
-Currently supports Configuration messages.
+Currently supports Configuration messages (and building them, for testing and load generation).
 """
 
 
@@ -25,11 +25,13 @@ Currently supports Configuration messages.
 """
 
 
+import errno
 import socket
-import time
-import threading
+import struct
 
-import wificonfiguration, wificonfiglogger
+import gobject
+
+import wificonfiguration, wificonfiglogger, wificonfigtrace
 
 __author__ = 'victor'
 
@@ -37,6 +39,8 @@ __author__ = 'victor'
 LUMINARE_PROTOCOL_UDP_PORT = 29000              # default port used for Simple Message Protocol communications
 LUMINARE_PROTOCOL_CONFIGURATION_MSG_TYPE = 9    # value for Luminare Configuration Message type
 LUMINARE_PROTOCOL_COMMAND_HEADER_SIZE = 8       # size of Simple Message Protocol header
+LUMINARE_PROTOCOL_MAX_MSG_SIZE = 512            # size of the buffer used to receive messages
+LISTENER_BATCH_SIZE = 64                        # messages read per main loop dispatch, so other sources are not starved
 
 OK = "OK"
 
@@ -57,6 +61,7 @@ def process_luminare_360_config_message(msg_data):
     Only valid for LUMINARE PROTOCOL CONFIGURATION messages.
     :param msg_data: a chunk of data bytes, the full Luminare Configuration message.
     :return: a data map with SSID and PSK for the received network configuration.
+    :raise IndexError, ValueError: if the message is truncated or its strings are not UTF-8.
     """
     index = LUMINARE_PROTOCOL_COMMAND_HEADER_SIZE
     ssid_len = ord(msg_data[index])
@@ -67,16 +72,33 @@ def process_luminare_360_config_message(msg_data):
     password_len = ord(msg_data[index])
     index += 2  # password len 2 bytes
     password_bytes = msg_data[index:index + password_len]
+    if len(ssid_bytes) != ssid_len or len(password_bytes) != password_len:
+        raise ValueError("Truncated configuration message")
     return {wificonfiguration.SSID: ssid_bytes.decode("utf-8"),
             wificonfiguration.PSK: password_bytes.decode("utf-8")}
 
 
+def build_luminare_360_config_message(ssid, psk):
+    """
+    Builds a Simple Message Protocol message, the inverse of process_luminare_360_config_message.
+    :param ssid: SSID of the network configuration.
+    :param psk: PSK of the network configuration.
+    :return: a chunk of data bytes, the full Luminare Configuration message.
+    """
+    ssid_bytes = ssid.encode("utf-8")
+    password_bytes = psk.encode("utf-8")
+    header = 'E' + chr(LUMINARE_PROTOCOL_CONFIGURATION_MSG_TYPE) + '\0' * (LUMINARE_PROTOCOL_COMMAND_HEADER_SIZE - 2)
+    return header \
+        + struct.pack("<H", len(ssid_bytes)) + ssid_bytes + '\0' \
+        + struct.pack("<H", len(password_bytes)) + password_bytes
+
+
 def message_is_smp(msg_data):
     """
     :param msg_data: chunk of bytes for a received message.
     :return: True if the data is recognized as a Simple Message Protocol Message.
     """
-    return (msg_data[0] == 'E') and (len(msg_data) > LUMINARE_PROTOCOL_COMMAND_HEADER_SIZE)
+    return (len(msg_data) > LUMINARE_PROTOCOL_COMMAND_HEADER_SIZE) and (msg_data[0] == 'E')
 
 
 LUMINARE_PROTOCOL_MSG_TYPE_SWITCHER = {
@@ -85,40 +107,96 @@ LUMINARE_PROTOCOL_MSG_TYPE_SWITCHER = {
 }
 
 
-class WifiConfigurationMessageListener(threading.Thread):
+class WifiConfigurationMessageListener:
     """
-    An object of this class has its own thread and listens to Simple Message Protocol messages.
+    An object of this class listens to Simple Message Protocol messages, from the GLib main loop.
     The messages are received as UDP universal broadcast.
     Each message that is identified as Simple Message Protocol Message is processed by a function that handles its type.
-    A callback function is used to send the processed data that comes as output of the handler function.
+    A callback function is used to send the processed data that comes as output of the handler function, along with
+    the configuration store (see wificonfigwatcher) given to the listener.
+    Datagrams that are not Simple Message Protocol messages, of an unknown type, or malformed, are logged and
+    discarded. The listener keeps counters of the received, processed and discarded datagrams, the monotonic time (ns)
+    of the first and last received ones, and the time (ns) spent handling them.
+    Errors of the callback function saving the configuration (EnvironmentError) are logged, and the listener goes on.
     """
 
-    def __init__(self, ip, callback_to_process_configuration, data_file_name):
-        threading.Thread.__init__(self)
+    def __init__(self, ip, callback_to_process_configuration, configuration_store, port=LUMINARE_PROTOCOL_UDP_PORT):
         self.ip = ip
+        self.port = port
         self.callback_to_process_configuration = callback_to_process_configuration
-        self.data_file_name = data_file_name
-        self.stopped = False
+        self.configuration_store = configuration_store
+        self.source_id = None
+        self.received = 0
+        self.processed = 0
+        self.discarded = 0
+        self.busy_time = 0
+        self.first_received = None
+        self.last_received = None
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    def stop(self):
-        self.stopped = True
+    def start(self):
+        """
+        Binds the socket, and starts listening from the main loop.
+        """
+        self.sock.bind(('', self.port))
+        self.sock.setblocking(False)
+        self.source_id = gobject.io_add_watch(self.sock.fileno(), gobject.IO_IN, self._on_readable)
 
-    def run(self):
-        self.sock.bind(('', LUMINARE_PROTOCOL_UDP_PORT))
-        while not self.stopped:
-            data = self.sock.recvfrom(512)
+    def stop(self):
+        """
+        Stops listening, and closes the socket.
+        """
+        if self.source_id is not None:
+            gobject.source_remove(self.source_id)
+            self.source_id = None
+        self.sock.close()
+
+    def _on_readable(self, fd, condition):
+        for i in range(LISTENER_BATCH_SIZE):
+            try:
+                data = self.sock.recvfrom(LUMINARE_PROTOCOL_MAX_MSG_SIZE)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
             wificonfiglogger.get_logger().info("Received raw message:" + str(data))
-            if message_is_smp(data[0]):
-                self._process_message(data[0])
-            time.sleep(1)
-        self.sock.shutdown
-        self.sock.close
+            self.handle_datagram(data[0])
+        return True
+
+    def handle_datagram(self, msg_data):
+        """
+        Processes a received datagram, if it is a Simple Message Protocol message.
+        :param msg_data: chunk of bytes for a received message.
+        """
+        self.last_received = wificonfigtrace.monotonic_ns()
+        if self.first_received is None:
+            self.first_received = self.last_received
+        self.received += 1
+        wificonfigtrace.trace_smp_datagram(msg_data)
+        if message_is_smp(msg_data):
+            self._process_message(msg_data)
+        else:
+            self.discarded += 1
+        self.busy_time += wificonfigtrace.monotonic_ns() - self.last_received
 
     def _process_message(self, msg_data):
         wificonfiglogger.get_logger().info("Processing SMP message")
-        selected_process_func = \
-            LUMINARE_PROTOCOL_MSG_TYPE_SWITCHER.get(ord(msg_data[1]), process_unidentified_message)
-        self.callback_to_process_configuration(selected_process_func(msg_data), self.data_file_name)
+        selected_process_func = LUMINARE_PROTOCOL_MSG_TYPE_SWITCHER.get(ord(msg_data[1]))
+        if selected_process_func is None:
+            self.discarded += 1
+            process_unidentified_message(msg_data)
+            return
+        try:
+            configuration = selected_process_func(msg_data)
+        except (IndexError, ValueError) as e:
+            self.discarded += 1
+            wificonfiglogger.get_logger().warning("Discarding malformed SMP message: " + repr(e))
+            return
+        self.processed += 1
+        try:
+            self.callback_to_process_configuration(configuration, self.configuration_store)
+        except EnvironmentError as e:
+            # i.e. the configuration data cannot be saved (disk full, read-only file system): keep listening
+            wificonfiglogger.get_logger().error("Cannot process the configuration: " + str(e))
 
 
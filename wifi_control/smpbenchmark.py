@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+"""
+Throughput benchmark for the Simple Message Protocol listener.
+Runs a WifiConfigurationMessageListener over loopback in a GLib main loop, as the daemon does, processing
+configurations into a scratch network configurations data file, and drives it with the load generator (see smploadgen)
+in a separate process. Reports:
+    * processed messages per second of time spent handling the datagrams (processing throughput), and the arrival
+      rate of the messages, from the first to the last received one.
+    * drop rate, from the kernel receive-queue overflow counter of the listener socket (/proc/net/udp).
+    * CPU time per received message, for this process (the load generator is not accounted).
+    * time from the first received packet to the first persisted configuration.
+The load is generated from a seed, so the same arguments send the same traffic on every run.
+Usage:
+    python -m wifi_control.smpbenchmark [--port PORT] [--count N] [--rate MSGS_PER_SECOND]
+                                        [--mix VALID:DUPLICATE:MALFORMED] [--seed SEED] [--rcvbuf BYTES]
+                                        [--log-file LOG_FILE_NAME]
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import os.path
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+
+import gobject
+
+import main, simplemessageprotocol, smploadgen, wificonfiguration, wificonfiglogger, wificonfigtrace, wificonfigwatcher
+
+__author__ = 'victor'
+
+
+PROC_NET_UDP_FILES = ("/proc/net/udp", "/proc/net/udp6")
+LOADGEN_MODULE = "wifi_control.smploadgen"
+DRAIN_TIMEOUT = 1               # seconds without new messages after which the listener is considered drained
+
+
+def get_socket_drops(sock):
+    """
+    Reads the number of datagrams dropped by the kernel for a UDP socket (i.e. because its receive queue was full).
+    :param sock: a bound UDP socket.
+    :return: the number of dropped datagrams, or None if it cannot be found.
+    """
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    for proc_file_name in PROC_NET_UDP_FILES:
+        try:
+            f = open(proc_file_name)
+        except IOError:
+            continue
+        lines = f.readlines()[1:]
+        f.close()
+        for line in lines:
+            fields = line.split()
+            # sl local_address rem_address st tx_queue:rx_queue tr:tm->when retrnsmt uid timeout inode ref pointer drops
+            if len(fields) >= 13 and fields[9] == inode:
+                return int(fields[12])
+    return None
+
+
+def get_cpu_time():
+    """
+    :return: user and system CPU time used by this process, in seconds.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class PersistenceProbe:
+    """
+    Processes configurations as the daemon does, and records when the first one was persisted.
+    Configurations are saved by renaming a new file into place, so a persisted one changes the inode of the data file.
+    """
+
+    def __init__(self, data_file_name):
+        self.initial_inode = os.stat(data_file_name).st_ino
+        self.first_persisted = None
+
+    def process_configuration(self, wifi_configuration, configuration_store):
+        main.process_configuration(wifi_configuration, configuration_store)
+        if self.first_persisted is None and os.stat(configuration_store.data_file_name).st_ino != self.initial_inode:
+            self.first_persisted = wificonfigtrace.monotonic_ns()
+
+
+class DrainWatcher:
+    """
+    Quits the main loop once the load generator has exited and the listener has received no messages for a while.
+    """
+
+    def __init__(self, generator, listener, main_loop):
+        self.generator = generator
+        self.listener = listener
+        self.main_loop = main_loop
+        self.received = -1
+
+    def check(self):
+        if self.generator.poll() is None or self.received != self.listener.received:
+            self.received = self.listener.received
+            return True
+        self.main_loop.quit()
+        return False
+
+
+def run_benchmark(args, data_file_name):
+    """
+    Runs the load generator against a listener.
+    :return: a map with the measured values.
+    """
+    wificonfiguration.check_wifi_configurations_file(data_file_name)
+    configuration_store = wificonfigwatcher.WifiConfigurationFileWatcher(data_file_name)
+    probe = PersistenceProbe(data_file_name)
+    listener = simplemessageprotocol.WifiConfigurationMessageListener(
+        '127.0.0.1', probe.process_configuration, configuration_store, args.port)
+    if args.rcvbuf:
+        listener.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.rcvbuf)
+    listener.start()
+    main_loop = gobject.MainLoop()
+    cpu_start = get_cpu_time()
+    generator = subprocess.Popen([sys.executable, "-m", LOADGEN_MODULE,
+                                  "--port", str(args.port), "--count", str(args.count), "--rate", str(args.rate),
+                                  "--mix", args.mix, "--seed", str(args.seed)])
+    gobject.timeout_add_seconds(DRAIN_TIMEOUT, DrainWatcher(generator, listener, main_loop).check)
+    main_loop.run()
+    cpu_time = get_cpu_time() - cpu_start
+    drops = get_socket_drops(listener.sock)
+    listener.stop()
+    configuration_store.stop()
+    if generator.returncode != 0:
+        raise RuntimeError("Load generator failed with exit code %d" % generator.returncode)
+    results = {"received": listener.received,
+               "processed": listener.processed,
+               "discarded": listener.discarded,
+               "busy_time": listener.busy_time,
+               "drops": drops,
+               "cpu_time": cpu_time,
+               "first_received": listener.first_received,
+               "last_received": listener.last_received,
+               "first_persisted": probe.first_persisted}
+    return results
+
+
+def print_report(args, results):
+    counts = smploadgen.count_messages(
+        smploadgen.generate_messages(args.count, smploadgen.parse_mix(args.mix), args.seed))
+    received = results["received"]
+    print "Messages sent:        %d (%s)" % (
+        args.count, ", ".join("%d %s" % (counts[kind], kind) for kind in smploadgen.MESSAGE_KINDS))
+    print "Messages received:    %d (%d lost)" % (received, args.count - received)
+    if results["drops"] is None:
+        print "Socket drops:         unknown"
+    else:
+        print "Socket drops:         %d (%.2f %% of sent)" % (results["drops"], 100.0 * results["drops"] / args.count)
+    print "Configurations:       %d processed, %d discarded" % (results["processed"], results["discarded"])
+    if results["busy_time"] > 0:
+        busy_time = float(results["busy_time"]) / wificonfigtrace.NS_PER_SECOND
+        print "Throughput:           %.1f processed messages/s (%.3f s handling datagrams)" % (
+            results["processed"] / busy_time, busy_time)
+    if received > 1 and results["last_received"] > results["first_received"]:
+        elapsed = float(results["last_received"] - results["first_received"]) / wificonfigtrace.NS_PER_SECOND
+        print "Arrival rate:         %.1f messages/s" % ((received - 1) / elapsed)
+    if received > 0:
+        print "CPU per message:      %.1f us" % (results["cpu_time"] * 1000000.0 / received)
+    if results["first_persisted"] is None:
+        print "First persisted:      never"
+    else:
+        print "First persisted:      %.3f ms after the first packet" % (
+            (results["first_persisted"] - results["first_received"]) / 1000000.0)
+
+
+def main_benchmark():
+    parser = smploadgen.build_argument_parser()
+    parser.description = "Measures the throughput of the Simple Message Protocol listener."
+    parser.add_argument("--rcvbuf", type=int, default=0, help="receive buffer size of the listener socket")
+    parser.add_argument("--log-file", default=os.devnull, help="log file used by the listener")
+    args = parser.parse_args()
+    wificonfiglogger.initialize_logger(args.log_file)
+    work_dir = tempfile.mkdtemp(prefix="smpbenchmark")
+    try:
+        results = run_benchmark(args, os.path.join(work_dir, "wificonfig_data.p"))
+    finally:
+        shutil.rmtree(work_dir)
+    print_report(args, results)
+
+
+if __name__ == '__main__':
+    main_benchmark()
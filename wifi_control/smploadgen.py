@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+"""
+Load generator for the Simple Message Protocol listener.
+Sends UDP Luminare Configuration messages at a given rate, mixing:
+    * valid messages, each one with a new network configuration.
+    * duplicate messages, copies of an already sent valid message.
+    * malformed messages: truncated, unknown type, bad magic byte, or random bytes.
+The messages are generated from a seed, so the same arguments always send the same traffic.
+Usage:
+    python -m wifi_control.smploadgen [--host HOST] [--port PORT] [--count N] [--rate MSGS_PER_SECOND]
+                                      [--mix VALID:DUPLICATE:MALFORMED] [--seed SEED] [--broadcast]
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import argparse
+import random
+import socket
+import time
+
+import simplemessageprotocol, wificonfigtrace
+
+__author__ = 'victor'
+
+
+VALID = "valid"
+DUPLICATE = "duplicate"
+MALFORMED = "malformed"
+MESSAGE_KINDS = (VALID, DUPLICATE, MALFORMED)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_COUNT = 10000
+DEFAULT_RATE = 1000             # messages per second, 0 means as fast as possible
+DEFAULT_MIX = "60:30:10"        # weights for valid, duplicate and malformed messages
+DEFAULT_SEED = 360
+
+
+def parse_mix(mix):
+    """
+    :param mix: a "VALID:DUPLICATE:MALFORMED" String with the weight of each kind of message.
+    :return: a list of (kind, weight) tuples.
+    """
+    weights = [int(weight) for weight in mix.split(":")]
+    if len(weights) != 3 or min(weights) < 0 or sum(weights) == 0:
+        raise ValueError("Invalid message mix: " + mix)
+    return zip(MESSAGE_KINDS, weights)
+
+
+def _choose_kind(rnd, mix):
+    value = rnd.uniform(0, sum(weight for kind, weight in mix))
+    for kind, weight in mix:
+        if value < weight:
+            return kind
+        value -= weight
+    return mix[-1][0]
+
+
+def _build_malformed_message(rnd, valid_message):
+    variant = rnd.randrange(4)
+    if variant == 0:
+        # truncated in the middle of the strings
+        return valid_message[:rnd.randrange(simplemessageprotocol.LUMINARE_PROTOCOL_COMMAND_HEADER_SIZE + 1,
+                                            len(valid_message))]
+    if variant == 1:
+        # unknown message type
+        return valid_message[0] + chr(0xff) + valid_message[2:]
+    if variant == 2:
+        # not a Simple Message Protocol message
+        return 'X' + valid_message[1:]
+    return "".join(chr(rnd.randrange(256)) for _ in range(rnd.randrange(1, 64)))
+
+
+def generate_messages(count, mix, seed):
+    """
+    Builds the messages to send.
+    :param count: number of messages.
+    :param mix: a list of (kind, weight) tuples, as returned by parse_mix.
+    :param seed: seed for the random choices.
+    :return: a list of (kind, message bytes) tuples.
+    """
+    rnd = random.Random(seed)
+    valid_messages = []
+    messages = []
+    for i in range(count):
+        kind = _choose_kind(rnd, mix)
+        if kind == DUPLICATE and not valid_messages:
+            kind = VALID
+        if kind == DUPLICATE:
+            message = rnd.choice(valid_messages)
+        else:
+            message = simplemessageprotocol.build_luminare_360_config_message(
+                u"LoadGen-%06d" % i, u"LoadGenPassword-%06d" % i)
+            if kind == VALID:
+                valid_messages.append(message)
+            else:
+                message = _build_malformed_message(rnd, message)
+        messages.append((kind, message))
+    return messages
+
+
+def count_messages(messages):
+    """
+    :param messages: a list of (kind, message bytes) tuples, as returned by generate_messages.
+    :return: a map with the number of messages of each kind.
+    """
+    counts = dict((kind, 0) for kind in MESSAGE_KINDS)
+    for kind, message in messages:
+        counts[kind] += 1
+    return counts
+
+
+def send_messages(messages, host, port, rate, broadcast=False):
+    """
+    Sends the messages, spaced evenly at the given rate.
+    :param rate: messages per second, 0 to send them as fast as possible.
+    :return: the elapsed time, in seconds.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if broadcast:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    start = wificonfigtrace.monotonic_ns()
+    for i, (kind, message) in enumerate(messages):
+        if rate > 0:
+            delay = start + i * wificonfigtrace.NS_PER_SECOND // rate - wificonfigtrace.monotonic_ns()
+            if delay > 0:
+                time.sleep(float(delay) / wificonfigtrace.NS_PER_SECOND)
+        sock.sendto(message, (host, port))
+    elapsed = wificonfigtrace.monotonic_ns() - start
+    sock.close()
+    return float(elapsed) / wificonfigtrace.NS_PER_SECOND
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(description="Sends Simple Message Protocol load to a wificonfig listener.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=simplemessageprotocol.LUMINARE_PROTOCOL_UDP_PORT)
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT, help="number of messages to send")
+    parser.add_argument("--rate", type=int, default=DEFAULT_RATE, help="messages per second, 0 for no limit")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of VALID:DUPLICATE:MALFORMED messages")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--broadcast", action="store_true", help="allow sending to a broadcast address")
+    return parser
+
+
+def main_loadgen():
+    args = build_argument_parser().parse_args()
+    messages = generate_messages(args.count, parse_mix(args.mix), args.seed)
+    elapsed = send_messages(messages, args.host, args.port, args.rate, args.broadcast)
+    counts = count_messages(messages)
+    print "Sent %d messages (%s) in %.3f s" % (
+        len(messages), ", ".join("%d %s" % (counts[kind], kind) for kind in MESSAGE_KINDS), elapsed)
+
+
+if __name__ == '__main__':
+    main_loadgen()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+"""
+Replays a trace recorded by the daemon (see wificonfigtrace) against a stand-in bus, to reproduce problems on a
+development box without wpa_supplicant or a WiFi network.
+The daemon's connection sequence, roam monitor and management requests controller are run in a GLib main loop, as in
+the daemon, and the recorded SMP datagrams, wpa_supplicant signals, management requests and configuration data reloads
+of one session are fed to them at their recorded offsets, or as fast as possible. Their timers run on a replay clock
+that follows the trace, so both ways replay the same sequence.
+The method calls the daemon makes to wpa_supplicant meanwhile are answered with the recorded replies.
+Usage:
+    python -m wifi_control.wificonfigreplay [--fast] [--session N] TRACE_FILE_NAME DATA_FILE_NAME LOG_FILE_NAME
+The network configurations data file is overwritten with the configuration data recorded at the start of the
+session (if the trace has it), and modified by the replay, so a scratch file should be used.
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import argparse
+import copy
+
+import dbus.exceptions
+import gobject
+
+import main, simplemessageprotocol, wifiwpadbus, wificonfiguration, wificonfiglogger, wificonfigtrace, wificonfigwatcher
+
+__author__ = 'victor'
+
+
+REPLAY_NOT_RECORDED_ERROR = 'com.mytechia.wificonfig.Error.NotRecorded'
+REPLAYED_KINDS = {wificonfigtrace.SMP_DATAGRAM: "SMP datagrams",
+                  wificonfigtrace.DBUS_SIGNAL: "signals",
+                  wificonfigtrace.SERVICE_CALL: "management requests",
+                  wificonfigtrace.CONFIGURATION_RELOAD: "configuration reloads"}
+REPLAY_LINGER = 1                # seconds of trace time the daemon keeps running after the last record of the session
+NS_PER_MS = 1000000
+
+
+def _call_key(object_path, interface_name, method_name, args):
+    return object_path, interface_name, method_name, repr(wificonfigtrace.to_plain(args))
+
+
+class ReplayBus:
+    """
+    Stand-in for the system bus, it answers the method calls made to wpa_supplicant with the recorded replies.
+    For a given call (object path, interface, method and arguments), the reply used is the last one recorded up to the
+    replay clock (a trace timestamp), or the first one recorded if that call was not made yet at that time.
+    Calls that were never recorded (i.e. the replay has diverged) fail with a DBusException, as a call to an unavailable
+    wpa_supplicant would, and are counted as unanswered.
+    """
+
+    def __init__(self, records, clock):
+        self.clock = clock
+        self.answered = 0
+        self.unanswered = 0
+        self.replies = {}
+        pending_calls = {}
+        for kind, timestamp, payload in records:
+            if kind == wificonfigtrace.DBUS_CALL:
+                pending_calls.setdefault(payload[:3], []).append(_call_key(*payload))
+            elif kind in (wificonfigtrace.DBUS_REPLY, wificonfigtrace.DBUS_ERROR):
+                calls = pending_calls.get(payload[:3])
+                if not calls:
+                    continue
+                self.replies.setdefault(calls.pop(0), []).append((timestamp, kind, payload[3:]))
+
+    def call(self, object_path, interface_name, method_name, args):
+        key = _call_key(object_path, interface_name, method_name, args)
+        replies = self.replies.get(key)
+        if not replies:
+            self.unanswered += 1
+            wificonfiglogger.get_logger().warning("Replay: no recorded reply for " + str(key))
+            raise dbus.exceptions.DBusException("No recorded reply for " + str(key), name=REPLAY_NOT_RECORDED_ERROR)
+        self.answered += 1
+        now = self.clock()
+        selected = replies[0]
+        for reply in replies:
+            if reply[0] > now:
+                break
+            selected = reply
+        timestamp, kind, values = selected
+        if kind == wificonfigtrace.DBUS_ERROR:
+            raise dbus.exceptions.DBusException(values[1], name=values[0])
+        return copy.deepcopy(values[0])
+
+
+class ReplayTimers:
+    """
+    Timers on the replay clock, that follows the trace timestamps: the timers set by the daemon code are not run by
+    the main loop, but by the Replayer, in trace order with the recorded events.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.timers = {}
+        self.last_timer_id = 0
+
+    def now(self):
+        return self.clock
+
+    def add(self, seconds, callback, *args):
+        self.last_timer_id += 1
+        due = self.clock + seconds * wificonfigtrace.NS_PER_SECOND
+        self.timers[self.last_timer_id] = (due, seconds, callback, args)
+        return self.last_timer_id
+
+    def remove(self, timer_id):
+        self.timers.pop(timer_id, None)
+
+    def get_next(self):
+        """
+        :return: a (due time, timer id) tuple for the next timer to run, or None if there are no timers.
+        """
+        if not self.timers:
+            return None
+        return min((timer[0], timer_id) for timer_id, timer in self.timers.items())
+
+    def run(self, timer_id):
+        """
+        Advances the clock to the due time of the timer, and runs it.
+        """
+        due, seconds, callback, args = self.timers.pop(timer_id)
+        self.clock = due
+        if callback(*args):
+            self.timers[timer_id] = (due + seconds * wificonfigtrace.NS_PER_SECOND, seconds, callback, args)
+
+
+class ReplayConnectionSequence(main.ConnectionSequence):
+    """
+    The daemon's connection sequence, with a listener that is fed by the replay instead of a socket on the
+    Luminare Protocol port.
+    """
+
+    def _get_ip_address(self, ifname):
+        return "127.0.0.1"
+
+    def _create_listener(self, ip):
+        return simplemessageprotocol.WifiConfigurationMessageListener(
+            ip, main.process_configuration, self.configuration_store, 0)
+
+
+class Replayer:
+    """
+    Feeds the records of one session to the daemon code, from the main loop.
+    The replay clock starts at the start of the session, and is advanced in trace order, to the time of the next
+    recorded event or of the next timer set by the daemon code, whichever comes first. Each step is run by a main
+    loop timeout at its offset from the start of the session, or right after the previous one when replaying as fast
+    as possible: either way, the daemon code sees the same events, timers and replies in the same order.
+    The replay ends REPLAY_LINGER seconds (of trace time) after the last record of the session.
+    """
+
+    def __init__(self, records, configuration_store, fast):
+        self.events = [record for record in records if record[0] in REPLAYED_KINDS]
+        self.fast = fast
+        self.trace_start = records[0][1] if records else 0
+        self.trace_end = (records[-1][1] if records else 0) + REPLAY_LINGER * wificonfigtrace.NS_PER_SECOND
+        self.timers = ReplayTimers(self.trace_start)
+        self.bus = ReplayBus(records, self.timers.now)
+        self.connection_sequence = ReplayConnectionSequence(configuration_store, self.timers)
+        self.roam_monitor = wifiwpadbus.RoamMonitor(self.timers.now)
+        self.configuration_store = configuration_store
+        self.controller = wifiwpadbus.WiFiConfigurationController(
+            configuration_store, self.roam_monitor, self.connection_sequence.process_roaming_change)
+        self.idle_listener = simplemessageprotocol.WifiConfigurationMessageListener(
+            '', main.process_configuration, configuration_store)
+        self.main_loop = gobject.MainLoop()
+        self.replay_start = None
+        self.next_event = 0
+        self.timings = []
+        self.outside_listening = 0
+
+    def run(self):
+        """
+        Runs the daemon code and feeds it the events, until the end of the session.
+        """
+        wifiwpadbus.set_wpa_method_caller(self.bus.call)
+        wifiwpadbus.add_wpa_signal_handler(self.roam_monitor.handle_signal)
+        wifiwpadbus.add_wpa_signal_handler(self.connection_sequence.handle_signal)
+        self.configuration_store.start(
+            self.connection_sequence.process_running_change, self.connection_sequence.process_roaming_change)
+        self.replay_start = wificonfigtrace.monotonic_ns()
+        try:
+            wifiwpadbus.clean_configured_networks()
+        except main.CONNECTION_ERRORS as e:
+            wificonfiglogger.get_logger().warning("Cannot clean the configured networks: " + str(e))
+        self.connection_sequence.start()
+        self._schedule_next_step()
+        self.main_loop.run()
+        self.idle_listener.stop()
+        if self.connection_sequence.configurator_listener is not None:
+            self.connection_sequence.configurator_listener.stop()
+
+    def _get_next_step(self):
+        """
+        :return: the trace time of the next step, and the id of the timer to run then (None to dispatch an event).
+        """
+        next_timer = self.timers.get_next()
+        if self.next_event < len(self.events):
+            event_time = self.events[self.next_event][1]
+            if next_timer is None or next_timer[0] >= event_time:
+                return event_time, None
+        if next_timer is not None and next_timer[0] <= self.trace_end:
+            return next_timer
+        return self.trace_end, None
+
+    def _schedule_next_step(self):
+        step_time, timer_id = self._get_next_step()
+        delay = 0
+        if not self.fast:
+            elapsed = wificonfigtrace.monotonic_ns() - self.replay_start
+            delay = max(0, (step_time - self.trace_start - elapsed) // NS_PER_MS)
+        gobject.timeout_add(int(delay), self._run_step, timer_id)
+
+    def _run_step(self, timer_id):
+        if timer_id is not None:
+            self.timers.run(timer_id)
+        elif self.next_event < len(self.events):
+            self._dispatch_next_event()
+        else:
+            self.main_loop.quit()
+            return False
+        self._schedule_next_step()
+        return False
+
+    def _dispatch_next_event(self):
+        kind, timestamp, payload = self.events[self.next_event]
+        self.next_event += 1
+        self.timers.clock = timestamp
+        begin = wificonfigtrace.monotonic_ns()
+        if kind == wificonfigtrace.SMP_DATAGRAM:
+            listener = self.connection_sequence.configurator_listener
+            if listener is None:
+                # the daemon was listening when this datagram was recorded, but the replay has diverged
+                self.outside_listening += 1
+                listener = self.idle_listener
+            listener.handle_datagram(payload)
+        elif kind == wificonfigtrace.DBUS_SIGNAL:
+            wifiwpadbus.dispatch_wpa_signal(*payload)
+        elif kind == wificonfigtrace.SERVICE_CALL:
+            self._call_controller(*payload)
+        else:
+            self.configuration_store.load_wifi_configuration(wificonfiguration.WiFiConfiguration(payload[0]))
+        self.timings.append((kind, wificonfigtrace.monotonic_ns() - begin))
+
+    def _call_controller(self, method_name, args):
+        try:
+            getattr(self.controller, method_name)(*args)
+        except (ValueError,) + main.CONNECTION_ERRORS as e:
+            # as the DBUS service would, the error is returned to the management agent
+            wificonfiglogger.get_logger().warning("Replay: " + method_name + " failed: " + str(e))
+
+
+def print_summary(replayer, session_number, session_count, elapsed):
+    timings = replayer.timings
+    print "Session %d of %d" % (session_number, session_count)
+    print "Events replayed: %d (%s) in %.3f s" % (
+        len(timings),
+        ", ".join("%d %s" % (len([t for t in timings if t[0] == kind]), name)
+                  for kind, name in sorted(REPLAYED_KINDS.items())),
+        float(elapsed) / wificonfigtrace.NS_PER_SECOND)
+    if timings:
+        processing_times = [float(t[1]) / NS_PER_MS for t in timings]
+        print "Processing time per event: mean %.3f ms, max %.3f ms" % (
+            sum(processing_times) / len(processing_times), max(processing_times))
+    if replayer.outside_listening:
+        print "SMP datagrams received while the replayed daemon was not listening: %d" % replayer.outside_listening
+    print "Roam events: %d" % len(replayer.roam_monitor.get_roam_events())
+    print "wpa_supplicant calls: %d answered, %d without recorded reply" % (
+        replayer.bus.answered, replayer.bus.unanswered)
+
+
+def main_replay():
+    parser = argparse.ArgumentParser(description="Replays a wificonfig trace against a stand-in bus.")
+    parser.add_argument("--fast", action="store_true", help="feed the events as fast as possible")
+    parser.add_argument("--session", type=int, default=0,
+                        help="number of the session to replay, starting at 1 (default: the last one)")
+    parser.add_argument("trace_file_name")
+    parser.add_argument("data_file_name")
+    parser.add_argument("log_file_name")
+    args = parser.parse_args()
+    logger = wificonfiglogger.initialize_logger(args.log_file_name)
+    sessions = wificonfigtrace.split_sessions(list(wificonfigtrace.read_trace(args.trace_file_name)))
+    if not sessions:
+        parser.error("The trace has no records")
+    session_number = args.session if args.session > 0 else len(sessions)
+    if session_number > len(sessions):
+        parser.error("The trace has %d sessions" % len(sessions))
+    configuration_data = wificonfigtrace.get_session_configuration_data(sessions[session_number - 1])
+    if configuration_data is not None:
+        wificonfiguration.save_wifi_configuration_to(
+            args.data_file_name, wificonfiguration.WiFiConfiguration(configuration_data))
+    else:
+        logger.warning("The session has no recorded configuration data, using: " + args.data_file_name)
+    wificonfiguration.check_wifi_configurations_file(args.data_file_name)
+    configuration_store = wificonfigwatcher.WifiConfigurationFileWatcher(args.data_file_name)
+    replayer = Replayer(sessions[session_number - 1], configuration_store, args.fast)
+    start = wificonfigtrace.monotonic_ns()
+    replayer.run()
+    configuration_store.stop()
+    print_summary(replayer, session_number, len(sessions), wificonfigtrace.monotonic_ns() - start)
+
+
+if __name__ == '__main__':
+    main_replay()
@@ -0,0 +1,361 @@
+"""
+This module records a trace of the inputs and outputs of the daemon, so field problems can be replayed later.
+The trace is a compact, append-only binary file. Each record has:
+    * kind, 1 byte (session start, SMP datagram, D-Bus call, reply, error or signal).
+    * timestamp, 8 bytes, monotonic clock in nanoseconds.
+    * payload length, 4 bytes, followed by the payload.
+SMP datagram payloads are the raw datagram bytes. The other payloads are tuples of plain Python values (None, bool,
+int, float, str, unicode, tuple, list and dict), in a tagged binary encoding (see encode_value): unlike pickle, reading
+a trace collected in the field cannot run code.
+Besides the wpa_supplicant interactions, the inputs from management agents (the requests to the DBUS service that
+change something) and the reloads of the configuration data file are recorded too.
+Each daemon run starts a new session, with its own monotonic clock base (i.e. after a reboot), so a trace file is read
+as a list of sessions (see split_sessions). The session start records the configuration data the daemon started with,
+so a session can be replayed without a copy of the device's data file.
+The trace contains network credentials in clear text, so it is only readable by its owner.
+Tracing is disabled until start_tracing is called; while disabled, the trace_* functions do nothing.
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+
+__author__ = 'victor'
+
+
+TRACE_MAGIC = b"WCTRACE2"       # first bytes of every trace file
+
+SMP_DATAGRAM = 1                # record kind for a received Simple Message Protocol datagram
+DBUS_CALL = 2                   # record kind for a D-Bus method call made to wpa_supplicant
+DBUS_REPLY = 3                  # record kind for the reply to a D-Bus method call
+DBUS_ERROR = 4                  # record kind for the error raised by a D-Bus method call
+DBUS_SIGNAL = 5                 # record kind for a D-Bus signal emitted by wpa_supplicant
+SESSION_START = 6               # record kind for the start of a daemon session: wall clock time, pid, configuration
+SERVICE_CALL = 7                # record kind for a request to the DBUS service of the daemon
+CONFIGURATION_RELOAD = 8        # record kind for valid configuration data reloaded from the data file
+
+TRACE_FILE_MODE = 0o600
+
+RECORD_HEADER = struct.Struct(">BQI")   # kind, timestamp (ns), payload length
+
+CLOCK_MONOTONIC = 1
+NS_PER_SECOND = 1000000000
+
+LENGTH = struct.Struct(">I")            # length of a string, or number of items of a container, in encoded values
+FLOAT = struct.Struct(">d")
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+def monotonic_ns():
+    """
+    :return: the value of the monotonic clock, in nanoseconds.
+    """
+    timespec = _Timespec()
+    if _libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+        error_number = ctypes.get_errno()
+        raise OSError(error_number, os.strerror(error_number))
+    return timespec.tv_sec * NS_PER_SECOND + timespec.tv_nsec
+
+
+def to_plain(value):
+    """
+    Converts a value (i.e. dbus-python types, that subclass the Python builtin ones) to plain Python values,
+    so it can be encoded and read without dbus-python.
+    """
+    if isinstance(value, dict):
+        return dict((to_plain(k), to_plain(v)) for k, v in value.items())
+    if isinstance(value, tuple):
+        return tuple(to_plain(v) for v in value)
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    if isinstance(value, bool):
+        return bool(value)
+    if isinstance(value, unicode):
+        return unicode(value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (int, long)):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return value
+
+
+def _encode_value(value, chunks):
+    if value is None:
+        chunks.append(b"N")
+    elif isinstance(value, bool):
+        chunks.append(b"T" if value else b"F")
+    elif isinstance(value, (int, long)):
+        digits = str(value)
+        chunks.extend((b"i", LENGTH.pack(len(digits)), digits))
+    elif isinstance(value, float):
+        chunks.extend((b"f", FLOAT.pack(value)))
+    elif isinstance(value, str):
+        chunks.extend((b"s", LENGTH.pack(len(value)), value))
+    elif isinstance(value, unicode):
+        encoded = value.encode("utf-8")
+        chunks.extend((b"u", LENGTH.pack(len(encoded)), encoded))
+    elif isinstance(value, (tuple, list)):
+        chunks.extend((b"t" if isinstance(value, tuple) else b"l", LENGTH.pack(len(value))))
+        for item in value:
+            _encode_value(item, chunks)
+    elif isinstance(value, dict):
+        chunks.extend((b"d", LENGTH.pack(len(value))))
+        for key in sorted(value):
+            _encode_value(key, chunks)
+            _encode_value(value[key], chunks)
+    else:
+        raise TypeError("Cannot encode a " + type(value).__name__ + " in a trace")
+
+
+def encode_value(value):
+    """
+    Encodes a plain Python value (see to_plain) as a tag byte followed by its contents: N (None), T/F (bool),
+    i (int, as decimal digits), f (float), s (str), u (unicode, as UTF-8), t/l (tuple/list, with its items) and
+    d (dict, with its keys and values).
+    :return: the encoded bytes.
+    """
+    chunks = []
+    _encode_value(to_plain(value), chunks)
+    return b"".join(chunks)
+
+
+def _read_bytes(data, index, length):
+    if index + length > len(data):
+        raise ValueError("Truncated trace value")
+    return data[index:index + length], index + length
+
+
+def _decode_value(data, index):
+    tag, index = _read_bytes(data, index, 1)
+    if tag == b"N":
+        return None, index
+    if tag in (b"T", b"F"):
+        return tag == b"T", index
+    if tag == b"f":
+        raw, index = _read_bytes(data, index, FLOAT.size)
+        return FLOAT.unpack(raw)[0], index
+    raw, index = _read_bytes(data, index, LENGTH.size)
+    length = LENGTH.unpack(raw)[0]
+    if tag == b"i":
+        digits, index = _read_bytes(data, index, length)
+        return int(digits), index
+    if tag == b"s":
+        return _read_bytes(data, index, length)
+    if tag == b"u":
+        encoded, index = _read_bytes(data, index, length)
+        return encoded.decode("utf-8"), index
+    if tag in (b"t", b"l"):
+        items = []
+        for i in range(length):
+            item, index = _decode_value(data, index)
+            items.append(item)
+        return (tuple(items) if tag == b"t" else items), index
+    if tag == b"d":
+        items = {}
+        for i in range(length):
+            key, index = _decode_value(data, index)
+            items[key], index = _decode_value(data, index)
+        return items, index
+    raise ValueError("Unknown trace value tag: " + repr(tag))
+
+
+def decode_value(data):
+    """
+    Decodes a value encoded by encode_value.
+    :raise ValueError: if the data is not a single, complete encoded value.
+    """
+    value, index = _decode_value(data, 0)
+    if index != len(data):
+        raise ValueError("Trailing bytes after a trace value")
+    return value
+
+
+class TraceWriter:
+    """
+    Appends records to a trace file. Records can be written from any thread.
+    A file written by a version with another format (or not a trace file) is truncated.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, TRACE_FILE_MODE)
+        os.fchmod(fd, TRACE_FILE_MODE)
+        if os.read(fd, len(TRACE_MAGIC)) != TRACE_MAGIC:
+            os.ftruncate(fd, 0)
+        self.f = os.fdopen(fd, "ab")
+        if os.fstat(fd).st_size == 0:
+            self.f.write(TRACE_MAGIC)
+            self.f.flush()
+
+    def write_record(self, kind, payload):
+        timestamp = monotonic_ns()
+        with self.lock:
+            self.f.write(RECORD_HEADER.pack(kind, timestamp, len(payload)))
+            self.f.write(payload)
+            self.f.flush()
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+_trace_writer = None
+
+
+def start_tracing(path, configuration_data):
+    """
+    Starts appending records to the given trace file, in a new session.
+    :param configuration_data: the network configurations data the daemon starts with (see wificonfiguration).
+    """
+    global _trace_writer
+    stop_tracing()
+    _trace_writer = TraceWriter(path)
+    _trace_writer.write_record(SESSION_START, encode_value((time.time(), os.getpid(), configuration_data)))
+
+
+def stop_tracing():
+    global _trace_writer
+    if _trace_writer is not None:
+        _trace_writer.close()
+        _trace_writer = None
+
+
+def is_tracing():
+    return _trace_writer is not None
+
+
+def trace_smp_datagram(msg_data):
+    """
+    Records a received Simple Message Protocol datagram.
+    """
+    if _trace_writer is not None:
+        _trace_writer.write_record(SMP_DATAGRAM, msg_data)
+
+
+def _trace_values(kind, values):
+    if _trace_writer is not None:
+        _trace_writer.write_record(kind, encode_value(values))
+
+
+def trace_dbus_call(object_path, interface_name, method_name, args):
+    """
+    Records a D-Bus method call, before it is made.
+    """
+    _trace_values(DBUS_CALL, (object_path, interface_name, method_name, args))
+
+
+def trace_dbus_reply(object_path, interface_name, method_name, reply):
+    """
+    Records the reply to a D-Bus method call.
+    """
+    _trace_values(DBUS_REPLY, (object_path, interface_name, method_name, reply))
+
+
+def trace_dbus_error(object_path, interface_name, method_name, error_name, message):
+    """
+    Records the error raised by a D-Bus method call.
+    """
+    _trace_values(DBUS_ERROR, (object_path, interface_name, method_name, error_name, message))
+
+
+def trace_dbus_signal(object_path, interface_name, signal_name, args):
+    """
+    Records a received D-Bus signal.
+    """
+    _trace_values(DBUS_SIGNAL, (object_path, interface_name, signal_name, args))
+
+
+def trace_service_call(method_name, args):
+    """
+    Records a request to the DBUS service of the daemon, before it is handled.
+    """
+    _trace_values(SERVICE_CALL, (method_name, args))
+
+
+def trace_configuration_reload(configuration_data):
+    """
+    Records valid configuration data reloaded from the data file, before it is handled.
+    """
+    _trace_values(CONFIGURATION_RELOAD, (configuration_data,))
+
+
+def read_trace(path):
+    """
+    Reads a trace file. A truncated last record (i.e. the daemon was killed while writing it) is ignored.
+    :param path: full path for the trace file.
+    :return: a generator of (kind, timestamp, payload) tuples; payloads other than SMP datagrams are decoded.
+    """
+    f = open(path, "rb")
+    try:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError("Not a trace file: " + path)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            kind, timestamp, payload_len = RECORD_HEADER.unpack(header)
+            payload = f.read(payload_len)
+            if len(payload) < payload_len:
+                return
+            if kind != SMP_DATAGRAM:
+                payload = decode_value(payload)
+            yield kind, timestamp, payload
+    finally:
+        f.close()
+
+
+def get_session_configuration_data(session):
+    """
+    :param session: the records of a session, as returned by split_sessions.
+    :return: the configuration data recorded at the start of the session, or None if it was not recorded.
+    """
+    if not session or session[0][0] != SESSION_START or len(session[0][2]) < 3:
+        return None
+    return session[0][2][2]
+
+
+def split_sessions(records):
+    """
+    :param records: the records read from a trace, as returned by read_trace.
+    :return: a list of sessions, each one a list of records that starts with its SESSION_START record (records
+             written by older versions, without one, are returned as a first session).
+    """
+    sessions = []
+    for record in records:
+        if record[0] == SESSION_START or not sessions:
+            sessions.append([])
+        sessions[-1].append(record)
+    return sessions
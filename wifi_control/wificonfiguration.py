@@ -3,6 +3,8 @@ This module handles the structured data used to configure a WiFi network.
 A simple binary file is used to persist the data.
 The data model is quite simple: there are 3 different network configurations (bootstrap, default, current), one of them
 us used for the running network, and each network configuration has attributtes (PSK, SSID).
+A network configuration can also have roaming thresholds, used for wpa_supplicant background scans; when it has none,
+the default roaming thresholds are used.
 """
 
 
@@ -28,6 +30,8 @@ us used for the running network, and each network configuration has attributtes
 
 
 import pickle
+import hashlib
+import os
 import os.path
 
 
@@ -42,6 +46,17 @@ RUNNING = "Running"         # key for the running network configuration
 
 PSK = "psk"                 # key for the PSK value
 SSID = "ssid"               # key for the SSID value
+ROAMING = "roaming"         # key for the (optional) roaming thresholds
+
+SHORT_INTERVAL = "short_interval"       # key for the seconds between background scans when the signal is weak
+SIGNAL_THRESHOLD = "signal_threshold"   # key for the signal level (dBm) below which the signal is weak
+LONG_INTERVAL = "long_interval"         # key for the seconds between background scans when the signal is good
+
+DEFAULT_ROAMING = {SHORT_INTERVAL: 30, SIGNAL_THRESHOLD: -70, LONG_INTERVAL: 300}
+MIN_SIGNAL_THRESHOLD = -100     # dBm, plausible range for a signal level threshold
+MAX_SIGNAL_THRESHOLD = 0
+
+NETWORK_CONFIGURATIONS = (BOOTSTRAP, CURRENT, DEFAULT)
 
 
 class WiFiConfiguration:
@@ -68,6 +83,35 @@ class WiFiConfiguration:
         self.update_config(CURRENT, config)
         self.data[RUNNING] = CURRENT
 
+    def set_running_roaming_config(self, roaming):
+        self.get_running_config()[ROAMING] = roaming
+
+
+def get_roaming_config(config):
+    """
+    :param config: a network configuration.
+    :return: the roaming thresholds of the network configuration, or the default ones if it has none.
+    """
+    roaming = dict(DEFAULT_ROAMING)
+    roaming.update(config.get(ROAMING, {}))
+    return roaming
+
+
+def is_valid_roaming_config(roaming):
+    """
+    :param roaming: a map with roaming thresholds.
+    :return: True if the thresholds are known, integer (not bool), the signal threshold is a plausible level (between
+             MIN_SIGNAL_THRESHOLD and MAX_SIGNAL_THRESHOLD dBm), and the scan intervals are positive and ordered.
+    """
+    if not isinstance(roaming, dict) or not set(roaming.keys()) <= set(DEFAULT_ROAMING.keys()):
+        return False
+    if not all(isinstance(value, (int, long)) and not isinstance(value, bool) for value in roaming.values()):
+        return False
+    complete = dict(DEFAULT_ROAMING)
+    complete.update(roaming)
+    return 0 < complete[SHORT_INTERVAL] <= complete[LONG_INTERVAL] \
+        and MIN_SIGNAL_THRESHOLD <= complete[SIGNAL_THRESHOLD] <= MAX_SIGNAL_THRESHOLD
+
 
 def load_wifi_configuration_from(path):
     """
@@ -81,16 +125,62 @@ def load_wifi_configuration_from(path):
     return WiFiConfiguration(config_map)
 
 
+def parse_wifi_configuration(raw_data):
+    """
+    Builds a WiFiConfiguration instance from the raw contents of a configuration data file.
+    :param raw_data: the bytes read from the file that contains the persisted data.
+    :return: a WiFiConfiguration instance.
+    """
+    return WiFiConfiguration(pickle.loads(raw_data))
+
+
 def save_wifi_configuration_to(path, wifi_configuration):
     """
     Saves the configuration data to a binary file.
+    The data is written to a temporary file that is then renamed into place, so readers never see a partial file.
     :param path: full path for the file where the data is going to be saved.
     :param wifi_configuration: a WiFiConfiguration instance with the configuration data.
-    :return: nothing of consequence.
+    :return: the digest of the saved data.
     """
-    f = open(path, "wb")
-    pickle.dump(wifi_configuration.data, f)
+    raw_data = pickle.dumps(wifi_configuration.data)
+    digest = get_data_digest(raw_data)
+    tmp_path = path + ".tmp"
+    f = open(tmp_path, "wb")
+    f.write(raw_data)
+    f.flush()
+    os.fsync(f.fileno())
     f.close()
+    os.rename(tmp_path, path)
+    return digest
+
+
+def get_data_digest(raw_data):
+    """
+    :param raw_data: the raw contents of a configuration data file.
+    :return: a digest that identifies those contents.
+    """
+    return hashlib.sha1(raw_data).hexdigest()
+
+
+def is_valid_wifi_configuration(wifi_configuration):
+    """
+    Checks that the configuration data follows the data model: the three network configurations exist, each one
+    with SSID, PSK and valid roaming thresholds (if any), and the running network configuration points to one of them.
+    :param wifi_configuration: a WiFiConfiguration instance.
+    :return: True if the configuration data is usable.
+    """
+    data = wifi_configuration.data
+    if not isinstance(data, dict):
+        return False
+    for name in NETWORK_CONFIGURATIONS:
+        config = data.get(name)
+        if not isinstance(config, dict):
+            return False
+        if not isinstance(config.get(SSID), basestring) or not isinstance(config.get(PSK), basestring):
+            return False
+        if ROAMING in config and not is_valid_roaming_config(config[ROAMING]):
+            return False
+    return data.get(RUNNING) in NETWORK_CONFIGURATIONS
 
 
 def build_dumb_wifi_configurations():
@@ -115,6 +205,8 @@ def check_wifi_configurations_file(path):
     if not os.path.exists(path):
         save_wifi_configuration_to(path, WiFiConfiguration(build_dumb_wifi_configurations()))
     try:
-        load_wifi_configuration_from(path)
+        valid = is_valid_wifi_configuration(load_wifi_configuration_from(path))
     except:
+        valid = False
+    if not valid:
         save_wifi_configuration_to(path, WiFiConfiguration(build_dumb_wifi_configurations()))
@@ -0,0 +1,248 @@
+"""
+This module watches the network configuration data file, so changes made by external tools are picked up.
+It uses Linux inotify (through ctypes, no extra dependencies) on the directory that holds the data file, and handles:
+    * close-write events, for tools that rewrite the file in place.
+    * moved-to events, for tools that write a temporary file and rename it into place.
+The file is only reloaded and validated when its contents really changed, and writes made through the watcher (see
+WifiConfigurationFileWatcher.save_wifi_configuration) are ignored.
+The watcher keeps the last valid configuration data, so it is the store the daemon reads the configuration from:
+the file is only read when it changes, and an invalid file written by an external tool does not reach the daemon.
+"""
+
+
+"""
+ Copyright (C) 2015 Mytech Ingenieria Aplicada <http://www.mytechia.com>
+ Copyright (C) 2015 Victor Sonora Pombo <victor.pombo@mytechia.com>
+
+ This file is part of wifi_control.
+
+ wifi_control is free software: you can redistribute it and/or modify it under the
+ terms of the GNU General Public License as published by the Free
+ Software Foundation, either version 3 of the License, or (at your option) any
+ later version.
+
+ wifi_control is distributed in the hope that it will be useful, but WITHOUT ANY
+ WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ A PARTICULAR PURPOSE. See the GNU General Public License for more
+ details.
+
+ You should have received a copy of the GNU General Public License
+ along with wifi_control. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import copy
+import ctypes
+import ctypes.util
+import errno
+import os
+import os.path
+import struct
+
+import gobject
+
+import wificonfiguration, wificonfiglogger, wificonfigtrace
+
+__author__ = 'victor'
+
+
+IN_CLOSE_WRITE = 0x00000008     # file opened for writing was closed
+IN_MOVED_TO = 0x00000080        # file was moved into the watched directory
+IN_Q_OVERFLOW = 0x00004000      # event queue overflowed, some events were lost
+IN_IGNORED = 0x00008000         # watch was removed (i.e. the directory was deleted)
+IN_NONBLOCK = 0o4000            # inotify_init1 flag
+IN_CLOEXEC = 0o2000000          # inotify_init1 flag
+
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")    # wd, mask, cookie, len; followed by len bytes of name
+INOTIFY_READ_SIZE = 4096
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+def _check_inotify_result(result):
+    if result < 0:
+        error_number = ctypes.get_errno()
+        raise OSError(error_number, os.strerror(error_number))
+    return result
+
+
+def open_inotify_watch(directory, mask):
+    """
+    Creates an inotify instance that watches the given directory.
+    :param directory: full path of the directory to watch.
+    :param mask: inotify events to watch for.
+    :return: the file descriptor of the inotify instance.
+    """
+    fd = _check_inotify_result(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+    try:
+        _check_inotify_result(_libc.inotify_add_watch(fd, directory.encode("utf-8"), mask))
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+def parse_inotify_events(buf):
+    """
+    :param buf: a chunk of bytes read from an inotify file descriptor.
+    :return: a list of (mask, name) tuples, one for each event in the chunk.
+    """
+    events = []
+    index = 0
+    while index + INOTIFY_EVENT_HEADER.size <= len(buf):
+        wd, mask, cookie, name_len = INOTIFY_EVENT_HEADER.unpack_from(buf, index)
+        index += INOTIFY_EVENT_HEADER.size
+        name = buf[index:index + name_len].rstrip(b"\0")
+        index += name_len
+        events.append((mask, name))
+    return events
+
+
+def running_credentials(wifi_configuration):
+    """
+    :param wifi_configuration: a WiFiConfiguration instance.
+    :return: the (SSID, PSK) tuple of its running network configuration.
+    """
+    running_configuration = wifi_configuration.get_running_config()
+    return running_configuration[wificonfiguration.SSID], running_configuration[wificonfiguration.PSK]
+
+
+def running_roaming(wifi_configuration):
+    """
+    :param wifi_configuration: a WiFiConfiguration instance.
+    :return: the roaming thresholds of its running network configuration.
+    """
+    return wificonfiguration.get_roaming_config(wifi_configuration.get_running_config())
+
+
+class WifiConfigurationFileWatcher:
+    """
+    An object of this class watches the network configuration data file, from the GLib main loop.
+    Each time the file really changes, the new configuration data is validated and kept as the known configuration,
+    which is returned by get_wifi_configuration. Changes made by the daemon are saved with save_wifi_configuration.
+    Assumption: the file holds valid configuration data when the watcher is created (see
+    wificonfiguration.check_wifi_configurations_file).
+    Once started, a callback function is used when the running network configuration (SSID or PSK) has changed, and
+    another one (optional) when only its roaming thresholds have changed.
+    """
+
+    def __init__(self, data_file_name):
+        self.data_file_name = os.path.abspath(data_file_name)
+        self.data_file_base_name = os.path.basename(self.data_file_name).encode("utf-8")
+        self.callback_to_process_running_change = None
+        self.callback_to_process_roaming_change = None
+        self.source_id = None
+        self.last_digest = None
+        self.wifi_configuration = None
+        self.fd = open_inotify_watch(os.path.dirname(self.data_file_name), IN_CLOSE_WRITE | IN_MOVED_TO)
+        self._check_data_file()
+
+    def get_wifi_configuration(self):
+        """
+        :return: a copy of the last valid configuration data, as a WiFiConfiguration instance.
+        """
+        return wificonfiguration.WiFiConfiguration(copy.deepcopy(self.wifi_configuration.data))
+
+    def save_wifi_configuration(self, wifi_configuration):
+        """
+        Saves the configuration data to the file, and keeps it as the known configuration.
+        :param wifi_configuration: a WiFiConfiguration instance with the configuration data.
+        """
+        self.last_digest = wificonfiguration.save_wifi_configuration_to(self.data_file_name, wifi_configuration)
+        self.wifi_configuration = wificonfiguration.WiFiConfiguration(copy.deepcopy(wifi_configuration.data))
+
+    def start(self, callback_to_process_running_change, callback_to_process_roaming_change=None):
+        """
+        Starts watching from the main loop.
+        :param callback_to_process_running_change: function (wifi_configuration, watcher) called when the running
+               network configuration changed.
+        :param callback_to_process_roaming_change: function (wifi_configuration, watcher) called when only the roaming
+               thresholds of the running network configuration changed.
+        """
+        self.callback_to_process_running_change = callback_to_process_running_change
+        self.callback_to_process_roaming_change = callback_to_process_roaming_change
+        self.source_id = gobject.io_add_watch(self.fd, gobject.IO_IN, self._on_readable)
+
+    def stop(self):
+        """
+        Stops watching, and closes the inotify instance.
+        """
+        if self.source_id is not None:
+            gobject.source_remove(self.source_id)
+            self.source_id = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _on_readable(self, fd, condition):
+        self.handle_events()
+        return self.fd is not None
+
+    def handle_events(self):
+        """
+        Reads the pending inotify events and checks the data file if any of them could have changed it.
+        """
+        try:
+            buf = os.read(self.fd, INOTIFY_READ_SIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        data_file_touched = False
+        for mask, name in parse_inotify_events(buf):
+            if mask & IN_IGNORED:
+                wificonfiglogger.get_logger().warning(
+                    "Watch on " + os.path.dirname(self.data_file_name) + " removed, configuration changes are lost")
+                self.stop()
+                return
+            elif mask & IN_Q_OVERFLOW or name == self.data_file_base_name:
+                data_file_touched = True
+        if data_file_touched:
+            self._check_data_file()
+
+    def _read_data_file(self):
+        try:
+            f = open(self.data_file_name, "rb")
+        except IOError:
+            return None
+        raw_data = f.read()
+        f.close()
+        return raw_data
+
+    def _check_data_file(self):
+        raw_data = self._read_data_file()
+        if raw_data is None:
+            return
+        digest = wificonfiguration.get_data_digest(raw_data)
+        if digest == self.last_digest:
+            return
+        self.last_digest = digest
+        try:
+            wifi_configuration = wificonfiguration.parse_wifi_configuration(raw_data)
+        except Exception as e:
+            wificonfiglogger.get_logger().warning("Ignoring unreadable configuration data: " + str(e))
+            return
+        if not wificonfiguration.is_valid_wifi_configuration(wifi_configuration):
+            wificonfiglogger.get_logger().warning(
+                "Ignoring invalid configuration data: " + str(wifi_configuration.data))
+            return
+        wificonfigtrace.trace_configuration_reload(wifi_configuration.data)
+        self.load_wifi_configuration(wifi_configuration)
+
+    def load_wifi_configuration(self, wifi_configuration):
+        """
+        Keeps valid configuration data, reloaded from the file (or replayed, see wificonfigreplay), as the known
+        configuration, and calls the callbacks if the running network configuration changed.
+        :param wifi_configuration: a WiFiConfiguration instance with the configuration data.
+        """
+        previous_configuration = self.wifi_configuration
+        self.wifi_configuration = wifi_configuration
+        wificonfiglogger.get_logger().info("Configuration data changed on disk")
+        if previous_configuration is None or self.callback_to_process_running_change is None:
+            return
+        if running_credentials(previous_configuration) != running_credentials(wifi_configuration):
+            self.callback_to_process_running_change(wifi_configuration, self)
+        elif self.callback_to_process_roaming_change is not None \
+                and running_roaming(previous_configuration) != running_roaming(wifi_configuration):
+            self.callback_to_process_roaming_change(wifi_configuration, self)
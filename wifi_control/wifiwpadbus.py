@@ -1,8 +1,13 @@
 """
 This module offers an API built on top of dbus-python.
-Also contains WiFiConfigurationDBUSService, a DBUS service that handles:
+Every method call made to wpa_supplicant, and every signal received from it, goes through call_wpa_method and
+dispatch_wpa_signal, so they can be traced (see wificonfigtrace) and answered by a stand-in bus when replaying.
+Also contains RoamMonitor, that records the roam events of the managed network interface, and
+WiFiConfigurationDBUSService, a DBUS service that handles:
     * reconnect, method
     * disconnect, method
+    * roaming thresholds of the running network configuration, get and set methods
+    * recorded roam events, method
     * network configuration state change, signal
 """
 
@@ -28,14 +33,98 @@ Also contains WiFiConfigurationDBUSService, a DBUS service that handles:
 """
 
 
+import collections
+
 import dbus
 import dbus.service
-import wificonfiglogger
+import wificonfiguration, wificonfiglogger, wificonfigtrace
 
 
 __author__ = 'victor'
 
 
+WPA_SERVICE = 'fi.w1.wpa_supplicant1'                   # bus name, and manager interface, of wpa_supplicant
+WPA_OBJECT_PATH = '/fi/w1/wpa_supplicant1'              # object path of the wpa_supplicant manager
+WPA_INTERFACE = 'fi.w1.wpa_supplicant1.Interface'       # interface of the network interface objects
+WPA_NETWORK = 'fi.w1.wpa_supplicant1.Network'           # interface of the configured network objects
+WPA_BSS = 'fi.w1.wpa_supplicant1.BSS'                   # interface of the scanned BSS objects
+PROPERTIES = 'org.freedesktop.DBus.Properties'
+
+
+def _call_wpa_method_on_system_bus(object_path, interface_name, method_name, args):
+    proxy = dbus.SystemBus().get_object(WPA_SERVICE, object_path)
+    return dbus.Interface(proxy, interface_name).get_dbus_method(method_name)(*args)
+
+
+_wpa_method_caller = _call_wpa_method_on_system_bus
+_wpa_signal_handlers = []
+
+
+def set_wpa_method_caller(caller):
+    """
+    Replaces the function that makes the method calls to wpa_supplicant (i.e. with a stand-in bus).
+    :param caller: a function (object_path, interface_name, method_name, args) that returns the reply.
+    """
+    global _wpa_method_caller
+    _wpa_method_caller = caller
+
+
+def call_wpa_method(object_path, interface_name, method_name, *args):
+    """
+    Calls a method of a wpa_supplicant object, and returns its reply.
+    """
+    wificonfigtrace.trace_dbus_call(object_path, interface_name, method_name, args)
+    try:
+        reply = _wpa_method_caller(object_path, interface_name, method_name, args)
+    except dbus.exceptions.DBusException as e:
+        wificonfigtrace.trace_dbus_error(object_path, interface_name, method_name, e.get_dbus_name(), str(e))
+        raise
+    wificonfigtrace.trace_dbus_reply(object_path, interface_name, method_name, reply)
+    return reply
+
+
+def add_wpa_signal_handler(handler):
+    """
+    Adds a function (object_path, interface_name, signal_name, args) that is called for each wpa_supplicant signal.
+    """
+    _wpa_signal_handlers.append(handler)
+
+
+def dispatch_wpa_signal(object_path, interface_name, signal_name, args):
+    """
+    Passes a signal emitted by wpa_supplicant to every signal handler.
+    """
+    wificonfigtrace.trace_dbus_signal(object_path, interface_name, signal_name, args)
+    for handler in _wpa_signal_handlers:
+        handler(object_path, interface_name, signal_name, args)
+
+
+def get_changed_properties(interface_name, signal_name, args):
+    """
+    Extracts the changed properties from a wpa_supplicant PropertiesChanged signal.
+    :return: a (interface of the changed properties, map of changed properties) tuple, or None for other signals.
+    """
+    if signal_name != 'PropertiesChanged':
+        return None
+    if interface_name == PROPERTIES:
+        return args[0], args[1]
+    # wpa_supplicant also emits its own PropertiesChanged signal, on each object interface
+    return interface_name, args[0]
+
+
+def _on_wpa_signal(*args, **keywords):
+    dispatch_wpa_signal(keywords['path'], keywords['interface'], keywords['member'], args)
+
+
+def listen_to_wpa_signals():
+    """
+    Subscribes to the signals emitted by wpa_supplicant. They are dispatched by the main loop.
+    """
+    dbus.SystemBus().add_signal_receiver(
+        _on_wpa_signal, bus_name=WPA_SERVICE,
+        path_keyword='path', interface_keyword='interface', member_keyword='member')
+
+
 def get_wpa_proxy():
     """
     Returns a proxy object for the wpa_supplicant1 *manager* object.
@@ -61,15 +150,28 @@ def get_network_interfaces():
     """
     Returns the managed network interfaces.
     """
-    return get_wpa_properties_instance().Get('fi.w1.wpa_supplicant1', 'Interfaces')
+    return call_wpa_method(WPA_OBJECT_PATH, PROPERTIES, 'Get', WPA_SERVICE, 'Interfaces')
 
 
 def get_first_network_interface_proxy():
     """
     Returns the first managed wlan interface.
     """
-    wlan_interface_object_path = get_network_interfaces().pop()
-    return dbus.SystemBus().get_object('fi.w1.wpa_supplicant1', wlan_interface_object_path)
+    return dbus.SystemBus().get_object(WPA_SERVICE, get_first_network_interface_path())
+
+
+def get_first_network_interface_path():
+    """
+    Returns the object path of the first managed wlan interface.
+    """
+    return get_network_interfaces().pop()
+
+
+def get_managed_network_interface_path():
+    """
+    Returns the object path of the managed network interface.
+    """
+    return get_first_network_interface_path()
 
 
 def get_managed_network_interface_proxy():
@@ -97,7 +199,7 @@ def get_managed_network_property(property_name):
     """
     Returns the value for a given property in the currently managed network interface.
     """
-    return get_managed_network_interface_properties().Get('fi.w1.wpa_supplicant1.Interface', property_name)
+    return call_wpa_method(get_managed_network_interface_path(), PROPERTIES, 'Get', WPA_INTERFACE, property_name)
 
 
 def get_list_of_existing_networks():
@@ -126,62 +228,233 @@ def get_current_network_properties_properties():
     """
     Returns the properties map for the current active network.
     """
-    return dbus.Interface(
-        get_current_network_proxy(),
-        'org.freedesktop.DBus.Properties').Get('fi.w1.wpa_supplicant1.Network', 'Properties')
+    return call_wpa_method(get_managed_network_property('CurrentNetwork'), PROPERTIES, 'Get', WPA_NETWORK, 'Properties')
+
+
+def build_bgscan(short_interval, signal_threshold, long_interval):
+    """
+    Builds the value of the bgscan network property, for the wpa_supplicant "simple" background scan module.
+    :param short_interval: seconds between background scans when the signal is below the threshold.
+    :param signal_threshold: signal level (dBm).
+    :param long_interval: seconds between background scans when the signal is above the threshold.
+    """
+    return "simple:%d:%d:%d" % (short_interval, signal_threshold, long_interval)
 
 
-def create_new_network_properties_map(ssid, psk):
+def create_new_network_properties_map(ssid, psk, bgscan=None):
     """
     Builds a map for a new network, with the given properties.
     """
-    return dbus.Dictionary({"ssid": dbus.ByteArray(ssid), "psk": dbus.String(psk)}, signature="sv")
+    properties_map = dbus.Dictionary({"ssid": dbus.ByteArray(ssid), "psk": dbus.String(psk)}, signature="sv")
+    if bgscan is not None:
+        properties_map["bgscan"] = dbus.String(bgscan)
+    return properties_map
 
 
 def add_new_network(properties_map):
     """
     Adds a new network configuration and returns its assigned object path.
     """
-    return get_managed_network_interface_instance().AddNetwork(properties_map)
+    return call_wpa_method(get_managed_network_interface_path(), WPA_INTERFACE, 'AddNetwork', properties_map)
+
+
+def set_network_bgscan(network_object_path, bgscan):
+    """
+    Changes the bgscan property of the given network, if it is the current active one, and reassociates to it:
+    wpa_supplicant only starts the background scan when a connection completes, so the new value would not be used
+    until the next connection.
+    :return: True if it was changed, False if the network is not the current active one.
+    """
+    if get_managed_network_property('CurrentNetwork') != network_object_path:
+        return False
+    call_wpa_method(
+        network_object_path, PROPERTIES, 'Set', WPA_NETWORK, 'Properties',
+        dbus.Dictionary({"bgscan": dbus.String(bgscan)}, signature="sv"))
+    reconnect()
+    return True
 
 
 def connect_to_network(network_object_path):
     """
     Connect to the given configured network.
     """
-    get_managed_network_interface_instance().SelectNetwork(dbus.ObjectPath(network_object_path))
+    call_wpa_method(
+        get_managed_network_interface_path(), WPA_INTERFACE, 'SelectNetwork', dbus.ObjectPath(network_object_path))
 
 
 def disconnect():
     """
     Disconnect from current network interface.
     """
-    get_managed_network_interface_instance().Disconnect()
+    call_wpa_method(get_managed_network_interface_path(), WPA_INTERFACE, 'Disconnect')
 
 
 def reconnect():
     """
     Reconnect current network interface.
     """
-    get_managed_network_interface_instance().Reassociate()
+    call_wpa_method(get_managed_network_interface_path(), WPA_INTERFACE, 'Reassociate')
 
 
 def clean_configured_networks():
     """
     Remove all network configurations from current network interface.
     """
-    get_managed_network_interface_instance().RemoveAllNetworks()
+    call_wpa_method(get_managed_network_interface_path(), WPA_INTERFACE, 'RemoveAllNetworks')
+
+
+ROAM_EVENTS_KEPT = 32       # number of recorded roam events kept by a RoamMonitor
+
+
+class RoamMonitor:
+    """
+    Watches the State, CurrentNetwork, CurrentBSS and signal level changes of the managed network interface (its
+    signal handler must be added with add_wpa_signal_handler), and records a roam event each time the interface ends
+    up completed on a different BSS of the same network. The duration of a roam goes from the moment the old BSS is
+    left until the connection completes.
+    A change of network, or a disconnection (state "disconnected", or no current BSS) in the middle, is not a roam:
+    no event is recorded, and the next roam can only start once a connection completes again.
+    Durations are measured with the monotonic clock, unless another clock function (returning ns) is given.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else wificonfigtrace.monotonic_ns
+        self.state = None
+        self.current_network = None
+        self.current_bss = None
+        self.completed_bss = None
+        self.signal = None
+        self.roam_from_signal = None
+        self.roam_started = None
+        self.roam_events = collections.deque(maxlen=ROAM_EVENTS_KEPT)
+
+    def handle_signal(self, object_path, interface_name, signal_name, args):
+        changed_properties = get_changed_properties(interface_name, signal_name, args)
+        if changed_properties is None:
+            return
+        changed_interface_name, changed = changed_properties
+        if changed_interface_name == WPA_INTERFACE:
+            self._handle_interface_changes(changed)
+        elif changed_interface_name == WPA_BSS and object_path == self.current_bss and 'Signal' in changed:
+            self.signal = int(changed['Signal'])
+
+    def _handle_interface_changes(self, changed):
+        now = self.clock()
+        if 'CurrentNetwork' in changed:
+            new_network = str(changed['CurrentNetwork'])
+            if new_network != self.current_network:
+                self._reset_roam()
+                self.current_network = new_network
+        if 'CurrentBSS' in changed:
+            new_bss = str(changed['CurrentBSS'])
+            if new_bss != self.current_bss:
+                self._start_roam(now)
+                self.current_bss = new_bss
+                self.signal = None
+        if 'State' in changed:
+            new_state = str(changed['State'])
+            if self.state == 'completed' and new_state != 'completed':
+                self._start_roam(now)
+            self.state = new_state
+        if self.state == 'disconnected' or self.current_bss == '/':
+            self._reset_roam()
+        elif self.state == 'completed':
+            if self.roam_started is not None:
+                self._end_roam(now)
+            self.completed_bss = self.current_bss
+
+    def _start_roam(self, now):
+        if self.roam_started is None and self.completed_bss not in (None, '/'):
+            self.roam_from_signal = self.signal
+            self.roam_started = now
+
+    def _end_roam(self, now):
+        if self.current_bss not in (None, '/', self.completed_bss):
+            duration_ms = (now - self.roam_started) / 1000000.0
+            from_signal = self.roam_from_signal if self.roam_from_signal is not None else 0
+            self.roam_events.append((self.completed_bss, self.current_bss, duration_ms, from_signal))
+            wificonfiglogger.get_logger().info(
+                "Roamed from " + self.completed_bss + " (%d dBm) to " % from_signal + self.current_bss
+                + " in %.1f ms" % duration_ms)
+        self.roam_from_signal = None
+        self.roam_started = None
+
+    def _reset_roam(self):
+        self.completed_bss = None
+        self.roam_from_signal = None
+        self.roam_started = None
+
+    def get_roam_events(self):
+        """
+        :return: a list with the recorded roam events, as (from BSS, to BSS, duration in ms, signal level in dBm
+                 when leaving the old BSS, or 0 if unknown) tuples.
+        """
+        return list(self.roam_events)
+
+
+class WiFiConfigurationController:
+    """
+    Handles the requests of the management agents, as received by the DBUS service (see
+    WiFiConfigurationDBUSService), without depending on the bus, so they can also be replayed (see wificonfigreplay).
+    The requests that change something are traced (see wificonfigtrace).
+    The roaming thresholds are stored in the network configurations data, kept by a configuration store (see
+    wificonfigwatcher), and applied with a function (wifi_configuration, configuration_store) of the connection
+    sequence.
+    """
+
+    def __init__(self, configuration_store, roam_monitor, apply_running_roaming):
+        self.configuration_store = configuration_store
+        self.roam_monitor = roam_monitor
+        self.apply_running_roaming = apply_running_roaming
+
+    def disconnect(self):
+        wificonfigtrace.trace_service_call('disconnect', ())
+        disconnect()
+
+    def reconnect(self):
+        wificonfigtrace.trace_service_call('reconnect', ())
+        reconnect()
+
+    def get_roaming_thresholds(self):
+        wifi_configuration = self.configuration_store.get_wifi_configuration()
+        roaming = wificonfiguration.get_roaming_config(wifi_configuration.get_running_config())
+        return (roaming[wificonfiguration.SHORT_INTERVAL],
+                roaming[wificonfiguration.SIGNAL_THRESHOLD],
+                roaming[wificonfiguration.LONG_INTERVAL])
+
+    def set_roaming_thresholds(self, short_interval, signal_threshold, long_interval):
+        """
+        Applies the roaming thresholds to the running network configuration, and stores them.
+        :return: True if they changed, False if they were already set.
+        """
+        wificonfigtrace.trace_service_call('set_roaming_thresholds', (short_interval, signal_threshold, long_interval))
+        roaming = {wificonfiguration.SHORT_INTERVAL: short_interval,
+                   wificonfiguration.SIGNAL_THRESHOLD: signal_threshold,
+                   wificonfiguration.LONG_INTERVAL: long_interval}
+        if not wificonfiguration.is_valid_roaming_config(roaming):
+            raise ValueError("Invalid roaming thresholds: " + str(roaming))
+        wifi_configuration = self.configuration_store.get_wifi_configuration()
+        if roaming == wificonfiguration.get_roaming_config(wifi_configuration.get_running_config()):
+            return False
+        wifi_configuration.set_running_roaming_config(roaming)
+        self.apply_running_roaming(wifi_configuration, self.configuration_store)
+        self.configuration_store.save_wifi_configuration(wifi_configuration)
+        return True
+
+    def get_roam_events(self):
+        return self.roam_monitor.get_roam_events()
 
 
 class WiFiConfigurationDBUSService(dbus.service.Object):
     """
     Encapsulates a DBUS service whose API handles connections to an already configured network configuration.
-    It uses wpa_supplicant, as handled by the API of this module.
+    It uses wpa_supplicant, as handled by the API of this module, through a WiFiConfigurationController.
     """
 
-    def __init__(self):
+    def __init__(self, controller):
         bus_name = dbus.service.BusName('com.mytechia.wificonfig', bus=dbus.SystemBus())
         dbus.service.Object.__init__(self, bus_name, '/com/mytechia/wificonfig')
+        self.controller = controller
 
     @dbus.service.method('com.mytechia.wificonfig')
     def disconnect(self):
@@ -190,7 +463,7 @@ class WiFiConfigurationDBUSService(dbus.service.Object):
         :return:
         """
         self.signal_state_change('disconnect')
-        disconnect()
+        self.controller.disconnect()
 
     @dbus.service.method('com.mytechia.wificonfig')
     def reconnect(self):
@@ -199,7 +472,36 @@ class WiFiConfigurationDBUSService(dbus.service.Object):
         :return:
         """
         self.signal_state_change('reconnect')
-        reconnect()
+        self.controller.reconnect()
+
+    @dbus.service.method('com.mytechia.wificonfig', out_signature='iii')
+    def get_roaming_thresholds(self):
+        """
+        Returns the roaming thresholds of the running network configuration.
+        :return: short scan interval (s), signal threshold (dBm), long scan interval (s).
+        """
+        return self.controller.get_roaming_thresholds()
+
+    @dbus.service.method('com.mytechia.wificonfig', in_signature='iii')
+    def set_roaming_thresholds(self, short_interval, signal_threshold, long_interval):
+        """
+        Stores the roaming thresholds in the running network configuration, and applies them to its network if
+        connected to it (reassociating).
+        :param short_interval: seconds between background scans when the signal is below the threshold.
+        :param signal_threshold: signal level (dBm).
+        :param long_interval: seconds between background scans when the signal is above the threshold.
+        :return:
+        """
+        if self.controller.set_roaming_thresholds(int(short_interval), int(signal_threshold), int(long_interval)):
+            self.signal_state_change('roaming')
+
+    @dbus.service.method('com.mytechia.wificonfig', out_signature='a(ssdi)')
+    def get_roam_events(self):
+        """
+        Returns the recorded roam events.
+        :return: a list of (from BSS, to BSS, duration in ms, signal level when leaving) structs.
+        """
+        return self.controller.get_roam_events()
 
     @dbus.service.signal('com.mytechia.wificonfig')
     def signal_state_change(self, message):